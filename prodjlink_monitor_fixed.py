@@ -6,29 +6,54 @@ ProDJLink Web监控器 - 修复版单文件
 """
 
 import asyncio
-import websockets
+import contextlib
 import socket
 import json
 import struct
 import threading
-from datetime import datetime
 import logging
 import sys
-import io
-import webbrowser
 import time
 import os
-import tempfile
+import gzip
+import hashlib
+import hmac
+import zlib
+from collections import OrderedDict, deque
+from http import HTTPStatus
 
-# 设置UTF-8编码
-if sys.platform == 'win32':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+# 仅服务所需的模块在此导入; 浏览器/临时文件/NumPy等在用到时才导入
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+np = None
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def load_numpy():
+    """按需导入NumPy (节奏分析为可选功能), 不可用时返回None"""
+    global np
+    if np is None:
+        try:
+            import numpy
+            np = numpy
+        except ImportError:
+            return None
+    return np
+
+def configure_console(log_level=logging.INFO):
+    """配置控制台编码与日志格式 (仅在作为程序运行时调用)"""
+    # 设置UTF-8编码
+    if sys.platform == 'win32':
+        import io
+        sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+        sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+    # 配置日志
+    logging.basicConfig(level=log_level, format='%(asctime)s - %(levelname)s - %(message)s')
+
 # HTML内容
 HTML_CONTENT = '''<!DOCTYPE html>
 <html lang="zh-CN">
@@ -220,7 +245,19 @@ HTML_CONTENT = '''<!DOCTYPE html>
             height: 8px;
             border-radius: 2px;
             background: #C4C4C4;
-            transition: all 0.1s;
+            transition: background-color 0.1s;
+        }
+
+        /* 从快照恢复、尚未被实时数据确认的设备 */
+        .device-card.provisional {
+            opacity: 0.6;
+        }
+
+        /* Web Worker模式: 节拍条绘制在OffscreenCanvas上 */
+        .beat-canvas {
+            display: block;
+            width: 152px;
+            height: 20px;
         }
 
         .beat-dot.active {
@@ -402,7 +439,242 @@ HTML_CONTENT = '''<!DOCTYPE html>
         </div>
     </div>
 
+    <!-- Web Worker模式 (?mode=worker): WebSocket接收、解码和节拍绘制都在Worker中完成 -->
+    <script type="text/js-worker" id="monitorWorker">
+        const PLAY_STATE_CLASS = { 0: 'empty', 2: 'loading', 3: 'playing', 4: 'looping', 5: 'paused', 6: 'cued', 7: 'cuing', 9: 'searching', 17: 'ended' };
+        const PLAY_STATE_TEXT = { 0: 'Empty', 2: 'Loading', 3: 'Playing', 4: 'Looping', 5: 'Paused', 6: 'Cued', 7: 'Cuing', 9: 'Searching', 17: 'Ended' };
+        // 与 .beat-bar 样式相同的几何尺寸 (CSS像素)
+        const BEAT = { width: 25, height: 8, gap: 12, padX: 8, padY: 6 };
+        const CANVAS_WIDTH = BEAT.padX * 2 + BEAT.width * 4 + BEAT.gap * 3;
+        const CANVAS_HEIGHT = BEAT.padY * 2 + BEAT.height;
+
+        const devices = new Map();     // key -> 设备信息
+        const decks = new Map();       // key -> 节拍相位与画布
+        const cardUpdates = new Map(); // key -> 待发送给主线程的显示字段
+        const pendingEchoes = [];
+        const stats = { packets: 0, updates: 0, devices: 0 };
+        let statsDirty = false;
+        let othersDirty = false;
+        let socketUrl = null;
+        let echoLatency = false;
+        let pixelRatio = 1;
+
+        self.onmessage = (event) => {
+            const message = event.data;
+            if (message.type === 'start') {
+                socketUrl = message.url;
+                echoLatency = message.echo;
+                pixelRatio = message.pixelRatio || 1;
+                connect();
+                scheduleFrame();
+            } else if (message.type === 'canvas') {
+                attachCanvas(message.key, message.canvas);
+            }
+        };
+
+        function connect() {
+            const ws = new WebSocket(socketUrl);
+            ws.onopen = () => postMessage({ type: 'connection', text: '已连接' });
+            ws.onerror = () => postMessage({ type: 'connection', text: '连接错误' });
+            ws.onclose = () => {
+                postMessage({ type: 'connection', text: '已断开' });
+                setTimeout(connect, 3000);
+            };
+            ws.onmessage = (event) => handleMessage(ws, JSON.parse(event.data));
+        }
+
+        function deviceKey(venue, id) {
+            return venue ? `${venue}/${id}` : String(id);
+        }
+
+        function deck(key) {
+            let entry = decks.get(key);
+            if (!entry) {
+                entry = { beat: 0, beatInMeasure: 0, beatTime: 0, lastPacket: 0, bpm: 0, playing: false, context: null, dirty: true };
+                decks.set(key, entry);
+            }
+            return entry;
+        }
+
+        function handleMessage(ws, data) {
+            stats.packets++;
+            statsDirty = true;
+            if (data.type === 'device') {
+                const key = deviceKey(data.device.venue, data.device.id);
+                devices.set(key, data.device);
+                stats.devices = devices.size;
+                if (data.device.type !== 'CDJ') {
+                    othersDirty = true;
+                } else {
+                    postMessage({ type: 'card', key: key, id: data.device.id, venue: data.device.venue || '',
+                                  provisional: !!data.device.provisional });
+                }
+            } else if (data.type === 'remove') {
+                const key = deviceKey(data.device.venue, data.device.id);
+                devices.delete(key);
+                decks.delete(key);
+                cardUpdates.delete(key);
+                stats.devices = devices.size;
+                othersDirty = true;
+                postMessage({ type: 'remove', key: key });
+            } else if (data.type === 'status') {
+                stats.updates++;
+                const key = deviceKey(data.status.venue, data.status.deviceId);
+                if (devices.has(key)) {
+                    updateDeck(key, data.status);
+                }
+            }
+            if (data.trace && echoLatency) {
+                pendingEchoes.push([ws, data.trace.id]);
+            }
+        }
+
+        function updateDeck(key, status) {
+            const entry = deck(key);
+            const now = performance.now();
+            const beat = status.beat || 0;
+            if (beat !== entry.beat) {
+                // 节拍发生在上一包与本包之间: 沿用预测的节拍网格, 超出区间时才修正
+                const predicted = entry.bpm > 0 && beat > entry.beat
+                    ? entry.beatTime + (beat - entry.beat) * 60000 / entry.bpm
+                    : now;
+                entry.beatTime = Math.min(Math.max(predicted, entry.lastPacket), now);
+                entry.beat = beat;
+            }
+            entry.beatInMeasure = status.beatInMeasure || 0;
+            entry.lastPacket = now;
+            entry.bpm = (status.bpm || 0) * (1 + (status.pitch || 0) / 100);
+            entry.playing = !!status.isPlaying;
+            entry.dirty = true;
+
+            const track = status.track;
+            cardUpdates.set(key, {
+                key: key,
+                provisional: !!status.provisional,
+                onAir: !!status.isOnAir,
+                playStateClass: PLAY_STATE_CLASS[status.playState] || 'empty',
+                playStateText: PLAY_STATE_TEXT[status.playState] || 'Unknown',
+                bpm: `${status.bpm ? status.bpm.toFixed(2) : '--'} BPM`,
+                pitch: status.pitch ? (status.pitch > 0 ? '+' : '') + status.pitch.toFixed(2) + '%' : '',
+                time: status.time ? `⏱️ ${status.time}` : '',
+                hasTrack: !!track,
+                title: track
+                    ? (track.title || `Track ID: ${track.id ? track.id.toString(16).toUpperCase().padStart(8, '0') : 'Unknown'}`)
+                    : 'No Track Loaded'
+            });
+        }
+
+        function attachCanvas(key, canvas) {
+            const entry = deck(key);
+            canvas.width = CANVAS_WIDTH * pixelRatio;
+            canvas.height = CANVAS_HEIGHT * pixelRatio;
+            entry.context = canvas.getContext('2d');
+            entry.context.scale(pixelRatio, pixelRatio);
+            entry.dirty = true;
+        }
+
+        function draw(entry, now) {
+            const context = entry.context;
+            context.fillStyle = '#efefef';
+            context.fillRect(0, 0, CANVAS_WIDTH, CANVAS_HEIGHT);
+
+            // 在两次状态更新之间按BPM插值拍内相位
+            const active = entry.beatInMeasure - 1;
+            const fraction = entry.playing && entry.bpm > 0
+                ? Math.min(Math.max((now - entry.beatTime) * entry.bpm / 60000, 0), 0.999)
+                : 0;
+
+            for (let index = 0; index < 4; index++) {
+                const x = BEAT.padX + index * (BEAT.width + BEAT.gap);
+                context.fillStyle = '#C4C4C4';
+                context.fillRect(x, BEAT.padY, BEAT.width, BEAT.height);
+                if (index === active) {
+                    context.fillStyle = `rgba(255, 148, 23, ${1 - fraction * 0.6})`;
+                    context.fillRect(x, BEAT.padY, BEAT.width, BEAT.height);
+                }
+            }
+
+            // 小节进度计量条
+            if (active >= 0) {
+                context.fillStyle = '#FF9417';
+                context.fillRect(BEAT.padX, BEAT.padY + BEAT.height + 2,
+                    (CANVAS_WIDTH - BEAT.padX * 2) * (active + fraction) / 4, 2);
+            }
+        }
+
+        function frame() {
+            const now = performance.now();
+            for (const entry of decks.values()) {
+                if (entry.context && (entry.dirty || entry.playing)) {
+                    draw(entry, now);
+                    entry.dirty = false;
+                }
+            }
+
+            if (cardUpdates.size || othersDirty || statsDirty) {
+                const message = { type: 'frame', cards: Array.from(cardUpdates.values()), stats: stats };
+                if (othersDirty) {
+                    message.others = Array.from(devices.values()).filter(device => device.type !== 'CDJ');
+                }
+                postMessage(message);
+                cardUpdates.clear();
+                othersDirty = false;
+                statsDirty = false;
+            }
+
+            while (pendingEchoes.length) {
+                const [ws, id] = pendingEchoes.shift();
+                if (ws.readyState === WebSocket.OPEN) {
+                    ws.send(JSON.stringify({ type: 'echo', trace: id }));
+                }
+            }
+            scheduleFrame();
+        }
+
+        function scheduleFrame() {
+            if (self.requestAnimationFrame) {
+                self.requestAnimationFrame(frame);
+            } else {
+                setTimeout(frame, 16);
+            }
+        }
+    </script>
+
     <script>
+        // 通过HTTP加载时连接同一主机端口, 以file://打开时回退到本机
+        function monitorSocketUrl() {
+            return location.protocol.startsWith('http')
+                ? `${location.protocol === 'https:' ? 'wss' : 'ws'}://${location.host}`
+                : 'ws://localhost:8080';
+        }
+
+        // 设备名称、场地等来自网络数据包, 插入HTML前必须转义
+        const HTML_ESCAPES = { '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;' };
+
+        function escapeHtml(value) {
+            return String(value).replace(/[&<>"']/g, ch => HTML_ESCAPES[ch]);
+        }
+
+        function renderOtherDevices(devices) {
+            const container = document.getElementById('otherDevices');
+            if (devices.length === 0) {
+                container.innerHTML = '';
+                return;
+            }
+            
+            container.innerHTML = devices.map(device => `
+                <div class="small-device">
+                    <div style="font-size: 1.25rem;">
+                        ${device.type === 'Mixer' ? '🎛️' : '💻'}
+                    </div>
+                    <div>
+                        <div style="font-weight: 600;">${escapeHtml(device.name || device.type)}</div>
+                        <div style="font-size: 0.75rem; color: #666;">${escapeHtml(device.ip)}</div>
+                    </div>
+                </div>
+            `).join('');
+        }
+
         // ProDJLink Web监控器
         class ProDJLinkMonitor {
             constructor() {
@@ -414,6 +686,8 @@ HTML_CONTENT = '''<!DOCTYPE html>
                     devices: 0
                 };
                 this.debugMode = false; // 可以设为true显示调试信息
+                // ?echo=1: 渲染后回显服务器追踪ID, 用于计算玻璃到玻璃延迟
+                this.echoLatency = new URLSearchParams(location.search).has('echo');
                 this.initializeUI();
                 this.connect();
             }
@@ -430,7 +704,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
             }
 
             connect() {
-                this.ws = new WebSocket('ws://localhost:8080');
+                this.ws = new WebSocket(monitorSocketUrl());
 
                 this.ws.onopen = () => {
                     console.log('WebSocket连接成功');
@@ -440,6 +714,14 @@ HTML_CONTENT = '''<!DOCTYPE html>
                 this.ws.onmessage = (event) => {
                     const data = JSON.parse(event.data);
                     this.handleMessage(data);
+                    if (data.trace && this.echoLatency) {
+                        const ws = this.ws;
+                        requestAnimationFrame(() => {
+                            if (ws.readyState === WebSocket.OPEN) {
+                                ws.send(JSON.stringify({ type: 'echo', trace: data.trace.id }));
+                            }
+                        });
+                    }
                 };
 
                 this.ws.onerror = (error) => {
@@ -467,6 +749,9 @@ HTML_CONTENT = '''<!DOCTYPE html>
                     case 'status':
                         this.updateStatus(data.status);
                         break;
+                    case 'remove':
+                        this.removeDevice(data.device);
+                        break;
                 }
                 this.updateStats();
                 
@@ -476,16 +761,32 @@ HTML_CONTENT = '''<!DOCTYPE html>
                 }
             }
 
+            deviceKey(venue, id) {
+                // hub模式下不同场地的设备ID可能重复
+                return venue ? `${venue}/${id}` : id;
+            }
+
             updateDevice(device) {
-                this.devices.set(device.id, device);
+                this.devices.set(this.deviceKey(device.venue, device.id), device);
+                this.renderDevices();
+            }
+
+            removeDevice(device) {
+                const key = this.deviceKey(device.venue, device.id);
+                this.devices.delete(key);
+                const card = document.querySelector(`[data-device-id="${CSS.escape(String(key))}"]`);
+                if (card) {
+                    card.remove();
+                }
                 this.renderDevices();
             }
 
             updateStatus(status) {
-                const device = this.devices.get(status.deviceId);
+                const key = this.deviceKey(status.venue, status.deviceId);
+                const device = this.devices.get(key);
                 if (device) {
                     device.status = status;
-                    this.renderDeviceCard(status.deviceId);
+                    this.renderDeviceCard(key);
                 }
                 this.stats.updates++;
             }
@@ -493,34 +794,36 @@ HTML_CONTENT = '''<!DOCTYPE html>
             renderDevices() {
                 const cdjs = Array.from(this.devices.values())
                     .filter(d => d.type === 'CDJ')
-                    .sort((a, b) => a.id - b.id);
+                    .sort((a, b) => (a.venue || '').localeCompare(b.venue || '') || a.id - b.id);
 
                 const others = Array.from(this.devices.values())
                     .filter(d => d.type !== 'CDJ');
 
-                cdjs.forEach(device => this.renderDeviceCard(device.id));
-                this.renderOtherDevices(others);
+                cdjs.forEach(device => this.renderDeviceCard(this.deviceKey(device.venue, device.id)));
+                renderOtherDevices(others);
             }
 
-            renderDeviceCard(deviceId) {
-                const device = this.devices.get(deviceId);
+            renderDeviceCard(deviceKey) {
+                const device = this.devices.get(deviceKey);
                 if (!device || device.type !== 'CDJ') return;
 
-                let card = document.querySelector(`[data-device-id="${deviceId}"]`);
+                let card = document.querySelector(`[data-device-id="${CSS.escape(String(deviceKey))}"]`);
                 if (!card) {
                     card = document.createElement('div');
                     card.className = 'device-card';
-                    card.dataset.deviceId = deviceId;
+                    card.dataset.deviceId = deviceKey;
                     document.getElementById('devicesContainer').appendChild(card);
                 }
 
                 const status = device.status || {};
                 const onAir = status.isOnAir ? 'onair' : '';
+                card.classList.toggle('provisional', !!(device.provisional || status.provisional));
                 const beatInMeasure = status.beatInMeasure || 0;
 
                 card.innerHTML = `
                     <div class="device-indicator">
-                        <div class="player-id ${onAir}">${deviceId.toString().padStart(2, '0')}</div>
+                        <div class="player-id ${onAir}">${escapeHtml(String(device.id).padStart(2, '0'))}</div>
+                        ${device.venue ? `<div style="font-size: 0.75rem; color: #666;">${escapeHtml(device.venue)}</div>` : ''}
                         <div class="device-icon">💿</div>
                     </div>
                     <div class="device-status">
@@ -540,7 +843,7 @@ HTML_CONTENT = '''<!DOCTYPE html>
                                 <span class="bpm-value">${status.bpm ? status.bpm.toFixed(2) : '--'} BPM</span>
                                 <span class="pitch-value">${status.pitch ? (status.pitch > 0 ? '+' : '') + status.pitch.toFixed(2) + '%' : ''}</span>
                             </div>
-                            ${status.time ? `<div style="font-size: 0.875rem; color: #666;">⏱️ ${status.time}</div>` : ''}
+                            ${status.time ? `<div style="font-size: 0.875rem; color: #666;">⏱️ ${escapeHtml(status.time)}</div>` : ''}
                         </div>
                         ${this.renderMetadata(status)}
                     </div>
@@ -558,32 +861,12 @@ HTML_CONTENT = '''<!DOCTYPE html>
                 return `
                     <div class="metadata-container">
                         <div class="track-info">
-                            <div class="track-title">${title}</div>
+                            <div class="track-title">${escapeHtml(title)}</div>
                         </div>
                     </div>
                 `;
             }
 
-            renderOtherDevices(devices) {
-                const container = document.getElementById('otherDevices');
-                if (devices.length === 0) {
-                    container.innerHTML = '';
-                    return;
-                }
-                
-                container.innerHTML = devices.map(device => `
-                    <div class="small-device">
-                        <div style="font-size: 1.25rem;">
-                            ${device.type === 'Mixer' ? '🎛️' : '💻'}
-                        </div>
-                        <div>
-                            <div style="font-weight: 600;">${device.name || device.type}</div>
-                            <div style="font-size: 0.75rem; color: #666;">${device.ip}</div>
-                        </div>
-                    </div>
-                `).join('');
-            }
-
             getPlayStateClass(state) {
                 const stateMap = {
                     0: 'empty',
@@ -627,171 +910,2654 @@ HTML_CONTENT = '''<!DOCTYPE html>
             
             updateDebugInfo(data) {
                 const debugContent = document.getElementById('debugContent');
-                debugContent.innerHTML = `<pre>${JSON.stringify(data, null, 2)}</pre>`;
+                debugContent.innerHTML = `<pre>${escapeHtml(JSON.stringify(data, null, 2))}</pre>`;
+            }
+        }
+
+        // Web Worker模式的主线程部分: 只创建卡片一次, 之后按字段差异更新文本
+        class WorkerMonitor {
+            constructor() {
+                this.cards = new Map();
+                const source = document.getElementById('monitorWorker').textContent;
+                const url = URL.createObjectURL(new Blob([source], { type: 'text/javascript' }));
+                this.worker = new Worker(url);
+                this.worker.onmessage = (event) => this.handleWorkerMessage(event.data);
+                this.worker.postMessage({
+                    type: 'start',
+                    url: monitorSocketUrl(),
+                    echo: new URLSearchParams(location.search).has('echo'),
+                    pixelRatio: window.devicePixelRatio || 1
+                });
+
+                this.updateTime();
+                setInterval(() => this.updateTime(), 1000);
+            }
+
+            handleWorkerMessage(message) {
+                switch (message.type) {
+                    case 'connection':
+                        document.getElementById('statusText').textContent = message.text;
+                        break;
+                    case 'card':
+                        this.updateCard(message);
+                        break;
+                    case 'remove':
+                        this.removeCard(message.key);
+                        break;
+                    case 'frame':
+                        this.applyFrame(message);
+                        break;
+                }
+            }
+
+            updateCard(message) {
+                const card = this.cards.get(message.key) || this.createCard(message);
+                card.provisional = message.provisional;
+                this.applyProvisional(card);
+            }
+
+            removeCard(key) {
+                const card = this.cards.get(key);
+                if (card) {
+                    card.element.remove();
+                    this.cards.delete(key);
+                }
+            }
+
+            applyProvisional(card) {
+                card.element.classList.toggle('provisional', !!(card.provisional || card.last.provisional));
+            }
+
+            createCard(message) {
+                document.getElementById('noDevices').style.display = 'none';
+
+                const card = document.createElement('div');
+                card.className = 'device-card';
+                card.dataset.deviceId = message.key;
+                card.dataset.sortKey = `${message.venue}/${String(message.id).padStart(3, '0')}`;
+                card.innerHTML = `
+                    <div class="device-indicator">
+                        <div class="player-id" data-field="playerId">${escapeHtml(String(message.id).padStart(2, '0'))}</div>
+                        ${message.venue ? `<div style="font-size: 0.75rem; color: #666;">${escapeHtml(message.venue)}</div>` : ''}
+                        <div class="device-icon">💿</div>
+                    </div>
+                    <div class="device-status">
+                        <div class="status-row">
+                            <div class="play-state empty" data-field="playState">Empty</div>
+                            <div class="beat-counter-wrapper"><canvas class="beat-canvas"></canvas></div>
+                            <div class="bpm-indicator">
+                                <span class="bpm-value" data-field="bpm">-- BPM</span>
+                                <span class="pitch-value" data-field="pitch"></span>
+                            </div>
+                            <div style="font-size: 0.875rem; color: #666;" data-field="time"></div>
+                        </div>
+                        <div class="metadata-container no-track" data-field="metadata">
+                            <div class="track-info">
+                                <div class="track-title" data-field="title">No Track Loaded</div>
+                            </div>
+                        </div>
+                    </div>
+                `;
+
+                // 按场地和设备ID排序插入
+                const container = document.getElementById('devicesContainer');
+                const next = Array.from(container.querySelectorAll('.device-card'))
+                    .find(other => other.dataset.sortKey > card.dataset.sortKey);
+                container.insertBefore(card, next || null);
+
+                const fields = {};
+                card.querySelectorAll('[data-field]').forEach(element => {
+                    fields[element.dataset.field] = element;
+                });
+                const entry = { element: card, fields: fields, last: {}, provisional: false };
+                this.cards.set(message.key, entry);
+
+                const offscreen = card.querySelector('canvas').transferControlToOffscreen();
+                this.worker.postMessage({ type: 'canvas', key: message.key, canvas: offscreen }, [offscreen]);
+                return entry;
+            }
+
+            applyFrame(message) {
+                for (const update of message.cards) {
+                    const card = this.cards.get(update.key);
+                    if (!card) continue;
+                    const { fields, last } = card;
+                    if (last.onAir !== update.onAir) {
+                        fields.playerId.classList.toggle('onair', update.onAir);
+                    }
+                    if (last.playStateClass !== update.playStateClass) {
+                        fields.playState.className = `play-state ${update.playStateClass}`;
+                    }
+                    if (last.hasTrack !== update.hasTrack) {
+                        fields.metadata.classList.toggle('no-track', !update.hasTrack);
+                    }
+                    this.setText(fields.playState, last.playStateText, update.playStateText);
+                    this.setText(fields.bpm, last.bpm, update.bpm);
+                    this.setText(fields.pitch, last.pitch, update.pitch);
+                    this.setText(fields.time, last.time, update.time);
+                    this.setText(fields.title, last.title, update.title);
+                    card.last = update;
+                    this.applyProvisional(card);
+                }
+
+                if (message.others) {
+                    if (message.others.length) {
+                        document.getElementById('noDevices').style.display = 'none';
+                    }
+                    renderOtherDevices(message.others);
+                }
+
+                document.getElementById('deviceCount').textContent = message.stats.devices;
+                document.getElementById('packetCount').textContent = message.stats.packets;
+                document.getElementById('updateCount').textContent = message.stats.updates;
+            }
+
+            setText(element, previous, value) {
+                if (previous !== value) {
+                    element.textContent = value;
+                }
+            }
+
+            updateTime() {
+                const now = new Date();
+                document.getElementById('currentTime').textContent = now.toLocaleString('zh-CN');
             }
         }
 
-        // 初始化监控器
-        const monitor = new ProDJLinkMonitor();
+        // 初始化监控器: ?mode=worker 且浏览器支持OffscreenCanvas时使用Web Worker模式
+        const workerMode = new URLSearchParams(location.search).get('mode') === 'worker'
+            && window.Worker && window.OffscreenCanvas
+            && 'transferControlToOffscreen' in HTMLCanvasElement.prototype;
+        const monitor = workerMode ? new WorkerMonitor() : new ProDJLinkMonitor();
     </script>
 </body>
 </html>'''
 
-class ProDJLinkWebSocketServer:
-    def __init__(self, websocket_port=8080):
-        self.PROLINK_HEADER = bytes([0x51, 0x73, 0x70, 0x74, 0x31, 0x57, 0x6D, 0x4A, 0x4F, 0x4C])
-        
-        self.ports = {
-            50000: "ANNOUNCE",
-            50001: "BEAT", 
-            50002: "STATUS"
+class TempoAnalytics:
+    """多设备节奏分析 - 基于NumPy的向量化计算
+
+    UDP线程通过 update() 写入每台设备的最新状态, 定时器通过 tick()
+    一次性计算所有设备的同步漂移、相位偏移和混音过渡。历史数据保存在
+    固定长度的环形缓冲中并维护滚动累加和, 每次tick的开销与历史长度无关。
+    """
+
+    def __init__(self, max_devices=16, history=64, tick_interval=0.25, stale_after=5.0):
+        self.max_devices = max_devices
+        self.history = history
+        self.tick_interval = tick_interval
+        self.stale_after = stale_after
+        self.lock = threading.Lock()
+
+        n = max_devices
+        # 最新状态 (由UDP线程写入)
+        self.bpm = np.zeros(n)
+        self.pitch = np.zeros(n)
+        self.beat = np.zeros(n, dtype=np.int64)
+        self.beat_time = np.zeros(n)   # 当前拍在推算节拍网格上的时间
+        self.last_seen = np.full(n, -np.inf)
+        self.playing = np.zeros(n, dtype=bool)
+        self.master = np.zeros(n, dtype=bool)
+        self.sync = np.zeros(n, dtype=bool)
+        self.on_air = np.zeros(n, dtype=bool)
+
+        # 历史环形缓冲 + 滚动累加和
+        self.head = 0
+        self.drift_hist = np.zeros((history, n))
+        self.delta_hist = np.zeros((history, n))
+        self.valid_hist = np.zeros((history, n), dtype=bool)
+        self.drift_sum = np.zeros(n)
+        self.drift_sq_sum = np.zeros(n)
+        self.delta_sum = np.zeros(n)
+        self.valid_count = np.zeros(n, dtype=np.int64)
+
+        self.prev_offset = np.full(n, np.nan)
+        self.prev_live = np.zeros(n, dtype=bool)
+        self.transition = None
+
+    def update(self, device_id, status, now=None):
+        """记录一台设备的最新状态"""
+        if not 0 <= device_id < self.max_devices:
+            return
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            beat = status.get('beat', 0)
+            bpm = status.get('bpm', 0.0)
+            pitch = status.get('pitch', 0.0)
+            previous_beat = self.beat[device_id]
+            if beat != previous_beat:
+                # 与BeatClock相同: 节拍发生在上一个包与本包之间, 沿用预测的节拍网格,
+                # 超出该区间时才修正, 相位不随包到达时间抖动
+                effective = bpm * (1.0 + pitch / 100.0)
+                last_packet = self.last_seen[device_id]
+                if effective <= 0 or not np.isfinite(last_packet) or self.beat_time[device_id] <= 0:
+                    beat_time = now
+                else:
+                    beat_time = self.beat_time[device_id] + (beat - previous_beat) * 60.0 / effective
+                    beat_time = min(max(beat_time, last_packet), now)
+                self.beat[device_id] = beat
+                self.beat_time[device_id] = beat_time
+            self.bpm[device_id] = bpm
+            self.pitch[device_id] = pitch
+            self.playing[device_id] = status.get('isPlaying', False)
+            self.master[device_id] = status.get('isMaster', False)
+            self.sync[device_id] = status.get('isSync', False)
+            self.on_air[device_id] = status.get('isOnAir', False)
+            self.last_seen[device_id] = now
+
+    def tick(self, now=None):
+        """计算一次所有设备的分析结果, 返回要发布的消息列表
+
+        第一条为analytics消息 (每次tick覆盖上一次, 慢客户端可以合并或跳过);
+        混音过渡的开始/结束各自作为一条transition消息, 不会被合并或丢弃。
+        没有活动设备时返回空列表。
+        """
+        if now is None:
+            now = time.monotonic()
+
+        with self.lock:
+            bpm = self.bpm.copy()
+            pitch = self.pitch.copy()
+            beat = self.beat.copy()
+            beat_time = self.beat_time.copy()
+            active = (now - self.last_seen) < self.stale_after
+            playing = self.playing & active
+            master = self.master & active
+            sync = self.sync & active
+            on_air = self.on_air & active
+
+        if not active.any():
+            return []
+
+        # 实际速度与插值后的节拍相位 (停止的设备不外推)
+        effective = bpm * (1.0 + pitch / 100.0)
+        elapsed = np.where(playing, now - beat_time, 0.0)
+        # 相位最多外推到下一拍之前, 等待下一个STATUS确认
+        phase = beat + np.clip(elapsed * effective / 60.0, 0.0, 0.999)
+
+        master_ids = np.flatnonzero(master)
+        drift = np.full(self.max_devices, np.nan)
+        offset = np.full(self.max_devices, np.nan)
+        master_id = None
+        if master_ids.size:
+            master_id = int(master_ids[0])
+            others = active & (np.arange(self.max_devices) != master_id)
+            drift = np.where(others & sync, effective - effective[master_id], np.nan)
+            offset = np.where(others & playing, phase - phase[master_id], np.nan)
+            offset = (offset + 0.5) % 1.0 - 0.5
+
+        # 相位变化量 (按一拍取模, 避免±0.5处的跳变)
+        delta = (offset - self.prev_offset + 0.5) % 1.0 - 0.5
+        self.prev_offset = offset
+        self._push_history(drift, delta)
+
+        events = self._detect_transition(playing & on_air, now)
+        messages = [self._build_message(active, effective, drift, offset, master_id, now)]
+        messages.extend({'type': 'transition', 'transition': event} for event in events)
+        return messages
+
+    def _push_history(self, drift, delta):
+        """写入环形缓冲, 同时增量维护滚动累加和"""
+        row = self.head
+        old_valid = self.valid_hist[row]
+        self.drift_sum -= np.where(old_valid, self.drift_hist[row], 0.0)
+        self.drift_sq_sum -= np.where(old_valid, self.drift_hist[row] ** 2, 0.0)
+        self.delta_sum -= np.where(old_valid, self.delta_hist[row], 0.0)
+        self.valid_count -= old_valid
+
+        valid = ~np.isnan(drift) & ~np.isnan(delta)
+        drift = np.where(valid, drift, 0.0)
+        delta = np.where(valid, delta, 0.0)
+        self.drift_hist[row] = drift
+        self.delta_hist[row] = delta
+        self.valid_hist[row] = valid
+        self.drift_sum += drift
+        self.drift_sq_sum += drift ** 2
+        self.delta_sum += delta
+        self.valid_count += valid
+
+        self.head = (row + 1) % self.history
+
+    def _detect_transition(self, live, now):
+        """根据在线(on-air)播放设备数量检测混音过渡的开始与结束"""
+        events = []
+        started = np.flatnonzero(live & ~self.prev_live).tolist()
+        stopped = np.flatnonzero(self.prev_live & ~live).tolist()
+        live_count = int(live.sum())
+
+        if self.transition is None and live_count >= 2:
+            self.transition = {
+                'startedAt': now,
+                'from': np.flatnonzero(self.prev_live).tolist(),
+                'to': started,
+            }
+            events.append({'event': 'transitionStart', 'from': self.transition['from'], 'to': started})
+        elif self.transition is not None and live_count <= 1:
+            events.append({
+                'event': 'transitionEnd',
+                'from': stopped,
+                'to': np.flatnonzero(live).tolist(),
+                'duration': round(now - self.transition['startedAt'], 3),
+            })
+            self.transition = None
+
+        self.prev_live = live
+        return events
+
+    def _build_message(self, active, effective, drift, offset, master_id, now):
+        """组装analytics消息"""
+        count = np.maximum(self.valid_count, 1)
+        drift_mean = self.drift_sum / count
+        drift_std = np.sqrt(np.maximum(self.drift_sq_sum / count - drift_mean ** 2, 0.0))
+        phase_trend = self.delta_sum / (count * self.tick_interval)
+        master_bpm = effective[master_id] if master_id is not None else 0.0
+
+        decks = []
+        for device_id in np.flatnonzero(active).tolist():
+            deck = {
+                'deviceId': device_id,
+                'effectiveBpm': round(float(effective[device_id]), 3),
+            }
+            if not np.isnan(drift[device_id]):
+                deck['drift'] = round(float(drift[device_id]), 4)
+            if self.valid_count[device_id]:
+                deck['driftMean'] = round(float(drift_mean[device_id]), 4)
+                deck['driftStd'] = round(float(drift_std[device_id]), 4)
+                deck['phaseTrend'] = round(float(phase_trend[device_id]), 4)
+            if not np.isnan(offset[device_id]):
+                deck['phaseOffset'] = round(float(offset[device_id]), 4)
+                if master_bpm > 0:
+                    deck['phaseOffsetMs'] = round(float(offset[device_id]) * 60000.0 / master_bpm, 2)
+            decks.append(deck)
+
+        transition = None
+        if self.transition is not None:
+            transition = {
+                'from': self.transition['from'],
+                'to': self.transition['to'],
+                'elapsed': round(now - self.transition['startedAt'], 3),
+            }
+
+        return {
+            'type': 'analytics',
+            'analytics': {
+                'masterId': master_id,
+                'decks': decks,
+                'transition': transition,
+            }
         }
-        
-        self.websocket_port = websocket_port
-        self.connected_clients = set()
-        
-        self.devices = {}
-        self.current_status = {}
-        
-        self.sockets = []
-        self.running = False
-        
-        self.message_queue = asyncio.Queue()
-        
-        self.debug_mode = True
-        self.packet_count = {50000: 0, 50001: 0, 50002: 0}
-        
-    def create_udp_socket(self, port):
-        """创建UDP套接字"""
-        try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            sock.bind(('0.0.0.0', port))
-            sock.settimeout(1.0)
-            self.sockets.append(sock)
-            logger.info(f"UDP socket bound to port {port}")
-            return sock
-        except Exception as e:
-            logger.error(f"Failed to create socket on port {port}: {e}")
+
+class PrecompressedAsset:
+    """一次性预压缩的资源, 支持ETag/304与缓存头
+
+    max_age为0时使用no-cache: 浏览器每次都用ETag重新验证, 未变化时只返回304。
+    长max-age只适合带版本指纹的URL。
+    """
+
+    def __init__(self, body, content_type='text/html; charset=utf-8', max_age=86400,
+                 cache_control=None, etag=None, gzip_level=9, brotli_quality=11, min_compress_size=0):
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control or (f'public, max-age={max_age}' if max_age else 'no-cache')
+        self.etag = etag or '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+
+        # 按客户端优先顺序排列的编码
+        self.variants = {}
+        if len(body) >= min_compress_size:
+            if brotli_quality is not None:
+                try:
+                    import brotli
+                    self.variants['br'] = brotli.compress(body, quality=brotli_quality)
+                except ImportError:
+                    pass
+            self.variants['gzip'] = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+        self.variants['identity'] = body
+
+    def matches(self, request_headers):
+        """检查If-None-Match是否命中当前ETag"""
+        if_none_match = request_headers.get('if-none-match')
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or self.etag in tags or f'W/{self.etag}' in tags
+
+    def choose_encoding(self, request_headers):
+        """根据Accept-Encoding选择已预压缩的版本"""
+        accepted = set()
+        for item in request_headers.get('accept-encoding', '').split(','):
+            name, _, params = item.strip().partition(';')
+            if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(name.strip().lower())
+        for encoding in self.variants:
+            if encoding in accepted:
+                return encoding
+        return 'identity'
+
+    def response(self, request_headers):
+        """生成 (status, headers, body) 供websockets的process_request返回"""
+        headers = [
+            ('ETag', self.etag),
+            ('Cache-Control', self.cache_control),
+            ('Vary', 'Accept-Encoding'),
+        ]
+        if self.matches(request_headers):
+            return HTTPStatus.NOT_MODIFIED, headers, b''
+
+        encoding = self.choose_encoding(request_headers)
+        headers.append(('Content-Type', self.content_type))
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        return HTTPStatus.OK, headers, self.variants[encoding]
+
+class PacketDeduplicator:
+    """按设备去重与乱序过滤 - 在完整解析前丢弃重复和过期的数据包
+
+    同一状态常同时以广播和单播到达, 部分交换机还会重复或乱序投递。
+    来源按 (IP, 包类型, 设备号) 区分, 同一主机上的多个播放器 (XDJ-XZ、
+    rekordbox等) 各自独立跟踪。CDJ状态包带有递增的包计数器, 据此丢弃重复和
+    过期的乱序包; 某来源超过sequence_timeout没有包被接受时忘记其计数器, 设备
+    重启后不会一直被判为过期。没有计数器的包则与该来源最近几个包的内容摘要
+    比较。来源表和摘要队列都有上限。
+    每个实例只由一个监听线程使用, 因此不需要加锁。
+    """
+
+    SEQUENCE_OFFSET = 0xC8   # CDJ状态包中的包计数器 (4字节)
+    STATUS_KIND = 0x0A
+    # (端口, 包类型) -> 设备号偏移
+    DEVICE_OFFSETS = {
+        (50000, 0x06): 0x24,  # 保活
+        (50001, 0x28): 0x21,  # 节拍
+        (50002, 0x0A): 0x21,  # CDJ状态
+        (50002, 0x29): 0x21,  # 调音台状态
+    }
+
+    def __init__(self, max_sources=64, recent=8, duplicate_window=0.5, reorder_window=32,
+                 sequence_timeout=1.5):
+        self.max_sources = max_sources
+        self.recent = recent
+        self.duplicate_window = duplicate_window
+        self.reorder_window = reorder_window
+        self.sequence_timeout = sequence_timeout
+        # (ip, kind, device) -> [last_sequence, deque((digest, time)), last_accepted]
+        self.sources = OrderedDict()
+        self.stats = {'received': 0, 'passed': 0, 'duplicates': 0, 'stale': 0}
+
+    def sequence_of(self, port, data):
+        """返回数据包中的包计数器, 没有时返回None"""
+        if port == 50002 and len(data) >= self.SEQUENCE_OFFSET + 4 and data[10] == self.STATUS_KIND:
+            return struct.unpack_from('>I', data, self.SEQUENCE_OFFSET)[0]
+        return None
+
+    def accept(self, port, data, addr, now=None):
+        """判断数据包是否需要继续处理"""
+        self.stats['received'] += 1
+        if now is None:
+            now = time.monotonic()
+
+        kind = data[10] if len(data) > 10 else -1
+        offset = self.DEVICE_OFFSETS.get((port, kind))
+        device = data[offset] if offset is not None and len(data) > offset else -1
+        key = (addr[0], kind, device)
+        entry = self.sources.get(key)
+        if entry is None:
+            entry = [None, deque(maxlen=self.recent), now]
+            self.sources[key] = entry
+            if len(self.sources) > self.max_sources:
+                self.sources.popitem(last=False)
+        else:
+            self.sources.move_to_end(key)
+
+        sequence = self.sequence_of(port, data)
+        if entry[0] is not None and now - entry[2] > self.sequence_timeout:
+            # 长时间没有接受该来源的包 (设备重启或离线), 重新开始跟踪计数器
+            entry[0] = None
+        if sequence is not None and entry[0] is not None:
+            diff = (sequence - entry[0]) & 0xFFFFFFFF
+            if diff == 0:
+                self.stats['duplicates'] += 1
+                return False
+            if diff >= 0x80000000 and (entry[0] - sequence) & 0xFFFFFFFF <= self.reorder_window:
+                self.stats['stale'] += 1
+                return False
+            # 计数器大幅回退视为设备重启, 重新开始跟踪
+
+        digest = hash(data)
+        recent = entry[1]
+        for seen_digest, seen_at in recent:
+            if seen_digest == digest and now - seen_at <= self.duplicate_window:
+                self.stats['duplicates'] += 1
+                return False
+
+        recent.append((digest, now))
+        entry[2] = now
+        if sequence is not None:
+            entry[0] = sequence
+        self.stats['passed'] += 1
+        return True
+
+# Pro DJ Link 包头与包类型
+PROLINK_HEADER = bytes([0x51, 0x73, 0x70, 0x74, 0x31, 0x57, 0x6D, 0x4A, 0x4F, 0x4C])
+PACKET_KIND_OFFSET = 0x0A
+
+KIND_KEEPALIVE = 0x06       # 端口50000: 设备保活/公告
+KIND_CDJ_STATUS = 0x0A      # 端口50002: CDJ状态
+KIND_MIXER_STATUS = 0x29    # 端口50002: 调音台状态
+
+KEEPALIVE_LENGTH = 0x36
+CDJ_STATUS_MIN_LENGTH = 170
+MIXER_STATUS_LENGTH = 0x38
+
+DEVICE_TYPE_NAMES = {1: "CDJ", 2: "Mixer", 3: "Mixer", 4: "Rekordbox"}
+
+class PacketRegistry:
+    """数据包分发表 - 按端口和包类型字节查表分发到专用解码器
+
+    每个端口预先建立256项的列表, 以包类型字节直接索引。包头只校验一次,
+    未注册或长度不足的包在一次比较和一次列表索引后即被丢弃。新的包类型
+    通过 register() 加入, 不影响已有类型的分发路径。
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.stats = {'dispatched': 0, 'ignored': 0, 'invalid': 0}
+
+    def register(self, port, kind, decoder, min_length=PACKET_KIND_OFFSET + 1, on_message=None):
+        """注册解码器: decoder(data, addr) -> message, on_message(message) 用于更新状态"""
+        table = self.tables.setdefault(port, [None] * 256)
+        table[kind] = (max(min_length, PACKET_KIND_OFFSET + 1), decoder, on_message)
+
+    def dispatch(self, port, data, addr):
+        """解码一个数据包, 不需要处理时返回None"""
+        table = self.tables.get(port)
+        if table is None or len(data) <= PACKET_KIND_OFFSET or not data.startswith(PROLINK_HEADER):
+            self.stats['invalid'] += 1
             return None
-    
-    def parse_announce_packet(self, data, addr):
-        """解析设备公告包"""
-        try:
-            if len(data) < 50 or data[:10] != self.PROLINK_HEADER:
-                return None
-                
-            device_info = {
-                'type': 'device',
-                'device': {
-                    'ip': addr[0],
-                    'type': 'Unknown',
-                    'id': 0,
-                    'name': 'Unknown Device'
-                }
-            }
-            
-            # 解析设备ID - 尝试多个可能的位置
-            for offset in [33, 36]:
-                if len(data) > offset:
-                    device_id = data[offset]
-                    if 0 < device_id <= 6:  # 有效的CDJ ID
-                        device_info['device']['id'] = device_id
-                        break
-                    
-            # 解析设备类型
-            if len(data) > 34:
-                device_type = data[34]
-                type_names = {1: "CDJ", 2: "Mixer", 3: "Rekordbox"}
-                device_info['device']['type'] = type_names.get(device_type, f'Type{device_type}')
-                
-                if device_type == 1:
-                    device_info['device']['name'] = f"CDJ-2000NXS2"
-                elif device_type == 2:
-                    device_info['device']['name'] = "DJM-900NXS2"
-                elif device_type == 3:
-                    device_info['device']['name'] = "Rekordbox"
-                    
-            return device_info
-            
-        except Exception as e:
-            logger.error(f"Failed to parse ANNOUNCE packet: {e}")
+
+        entry = table[data[PACKET_KIND_OFFSET]]
+        if entry is None or len(data) < entry[0]:
+            self.stats['ignored'] += 1
             return None
-    
-    def parse_status_packet(self, data):
-        """解析状态包 - 包含节拍信息"""
-        try:
-            if len(data) < 170 or data[:10] != self.PROLINK_HEADER:
-                return None
-                
-            status_info = {
-                'type': 'status',
-                'status': {}
+
+        self.stats['dispatched'] += 1
+        message = entry[1](data, addr)
+        if message and entry[2]:
+            entry[2](message)
+        return message
+
+def table_key(entry, device_id):
+    """设备表/状态表中的键: hub模式下为 '场地/设备ID', 否则为设备ID"""
+    venue = entry.get('venue')
+    return f"{venue}/{device_id}" if venue else device_id
+
+def state_key(message):
+    """返回设备/状态消息在状态表中的键, 其他消息返回None"""
+    kind = message.get('type')
+    if kind == 'device':
+        return 'device', table_key(message['device'], message['device']['id'])
+    if kind == 'status':
+        return 'status', table_key(message['status'], message['status']['deviceId'])
+    return None
+
+class EdgeRelay:
+    """边缘中继 - 将本场地已解码的状态变化合并压缩后批量转发到中心hub
+
+    每个键(设备/状态)只保留最新值, 批次内只发送变化的字段, 整批用zlib
+    压缩后作为二进制帧发送 (消失的字段以None发送)。每次变化分配递增版本号;
+    重连时hub报告已应用的版本, 中继只补发之后变化过的键的完整字段, 而不是
+    重放全部历史。
+    """
+
+    def __init__(self, url, venue, token=None, batch_interval=0.25):
+        self.url = url
+        self.venue = venue
+        self.token = token
+        self.batch_interval = batch_interval
+        self.epoch = os.urandom(8).hex()  # 本进程的状态纪元, 重启后hub需要全量同步
+
+        self.version = 0
+        self.latest = {}    # key -> 完整字段
+        self.versions = {}  # key -> 最近一次变化的版本
+        self.pending = {}   # key -> 待发送的变化字段
+        self.connected = False
+        self.stats = {'batches': 0, 'changes': 0, 'bytes': 0}
+
+    def record(self, message):
+        """记录一条消息中的状态变化 (在事件循环中调用)"""
+        key = state_key(message)
+        if key is None:
+            return
+        fields = message[key[0]]
+        previous = self.latest.get(key, {})
+        changed = {name: value for name, value in fields.items() if previous.get(name) != value}
+        changed.update((name, None) for name in previous if name not in fields)
+        if not changed:
+            return
+
+        self.latest[key] = dict(fields)
+        self.version += 1
+        self.versions[key] = self.version
+        if self.connected:
+            self.pending.setdefault(key, {}).update(changed)
+
+    def encode_batch(self, changes, replace=False):
+        """将变化列表编码为压缩的二进制帧; replace为True时hub用其替换整个条目"""
+        payload = json.dumps({
+            'op': 'batch',
+            'epoch': self.epoch,
+            'version': self.version,
+            'replace': replace,
+            'changes': [[kind, key_id, fields] for (kind, key_id), fields in changes.items()],
+        }, separators=(',', ':')).encode('utf-8')
+        frame = zlib.compress(payload, 6)
+        self.stats['batches'] += 1
+        self.stats['changes'] += len(changes)
+        self.stats['bytes'] += len(frame)
+        return frame
+
+    def resync_changes(self, epoch, version):
+        """根据hub已应用的纪元和版本计算需要补发的变化"""
+        if epoch != self.epoch:
+            return dict(self.latest)
+        return {key: self.latest[key] for key, changed_at in self.versions.items() if changed_at > version}
+
+    async def run(self, server):
+        """保持到hub的连接, 断线后指数退避重连"""
+        delay = 1.0
+        while server.running:
+            try:
+                async with websockets.connect(self.url, compression=None) as websocket:
+                    await websocket.send(json.dumps({
+                        'op': 'hello',
+                        'venue': self.venue,
+                        'token': self.token,
+                        'epoch': self.epoch,
+                    }))
+                    welcome = json.loads(await websocket.recv())
+                    if welcome.get('op') != 'welcome':
+                        raise ConnectionError(welcome.get('error', 'relay rejected by hub'))
+
+                    changes = self.resync_changes(welcome.get('epoch'), welcome.get('version', 0))
+                    self.pending = {}
+                    self.connected = True
+                    logger.info(f"Relay connected to {self.url} as '{self.venue}', "
+                                f"resyncing {len(changes)} of {len(self.latest)} entries")
+                    if changes:
+                        await websocket.send(self.encode_batch(changes, replace=True))
+                    delay = 1.0
+
+                    while server.running:
+                        await asyncio.sleep(self.batch_interval)
+                        if self.pending:
+                            changes, self.pending = self.pending, {}
+                            await websocket.send(self.encode_batch(changes))
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Relay link to {self.url} lost: {e}")
+            finally:
+                self.connected = False
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+class RelayHub:
+    """中心hub - 接收各场地中继的增量批次并合并为一个设备表
+
+    批次解压后的大小有上限, 防止小帧膨胀成巨大的负载。
+    """
+
+    MAX_BATCH_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, token=None):
+        self.token = token
+        self.venues = {}  # venue -> {'epoch', 'version'}
+
+    def authorized(self, token):
+        """校验中继令牌, 未设置令牌时接受所有中继"""
+        if not self.token:
+            return True
+        return isinstance(token, str) and hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    def decode_batch(self, frame):
+        """解压并解析一个批次, 超过大小上限时抛出ValueError"""
+        decompressor = zlib.decompressobj()
+        payload = decompressor.decompress(frame, self.MAX_BATCH_SIZE)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"relay batch larger than {self.MAX_BATCH_SIZE} bytes")
+        return json.loads(payload)
+
+    async def handle(self, websocket, server):
+        """处理一个中继连接"""
+        hello = json.loads(await websocket.recv())
+        if not isinstance(hello, dict):
+            hello = {}
+        venue = str(hello.get('venue') or '')
+        if hello.get('op') != 'hello' or not venue or not self.authorized(hello.get('token')):
+            await websocket.send(json.dumps({'op': 'error', 'error': 'invalid relay hello'}))
+            return
+
+        state = self.venues.setdefault(venue, {'epoch': None, 'version': 0})
+        await websocket.send(json.dumps({'op': 'welcome', 'epoch': state['epoch'], 'version': state['version']}))
+        if state['epoch'] != hello.get('epoch'):
+            # 中继已重启, 丢弃该场地的旧状态, 等待全量同步
+            self.drop_venue(server, venue)
+            state['epoch'] = hello.get('epoch')
+            state['version'] = 0
+        else:
+            # 同一纪元: 从快照恢复的条目与中继一致, 之后的变化会随补发到达
+            for message in self.confirm_venue(server, venue):
+                await server.message_queue.put(message)
+        logger.info(f"Relay '{venue}' connected from {websocket.remote_address}")
+
+        try:
+            async for frame in websocket:
+                if not isinstance(frame, bytes):
+                    continue
+                batch = self.decode_batch(frame)
+                replace = batch.get('replace', False)
+                for kind, key_id, fields in batch['changes']:
+                    message = self.apply(server, venue, kind, key_id, fields, replace)
+                    if message:
+                        await server.message_queue.put(message)
+                state['version'] = batch['version']
+        finally:
+            logger.info(f"Relay '{venue}' disconnected")
+
+    def apply(self, server, venue, kind, key_id, fields, replace=False):
+        """合并一个变化到hub的设备表 (值为None的字段被删除), 返回要广播的完整消息"""
+        key = f"{venue}/{key_id}"
+        if kind == 'device':
+            table = server.devices
+        elif kind == 'status':
+            table = server.current_status
+        else:
+            return None
+        entry = table.setdefault(key, {'venue': venue})
+        if replace:
+            entry.clear()
+            entry['venue'] = venue
+        for name, value in fields.items():
+            if value is None:
+                entry.pop(name, None)
+            else:
+                entry[name] = value
+        entry.pop('provisional', None)
+        return {'type': kind, kind: entry}
+
+    def confirm_venue(self, server, venue):
+        """确认某个场地从快照恢复的条目, 返回要广播的消息"""
+        prefix = f"{venue}/"
+        messages = []
+        for kind, table in (('device', server.devices), ('status', server.current_status)):
+            for key, entry in list(table.items()):
+                if isinstance(key, str) and key.startswith(prefix) and entry.pop('provisional', None):
+                    messages.append({'type': kind, kind: entry})
+        return messages
+
+    def drop_venue(self, server, venue):
+        """删除某个场地的全部设备和状态"""
+        prefix = f"{venue}/"
+        for table in (server.devices, server.current_status):
+            for key in [key for key in table if isinstance(key, str) and key.startswith(prefix)]:
+                del table[key]
+        server.state_snapshot.touch()
+
+# 共享内存状态表布局: 16字节表头 + 固定64字节槽位 (按设备ID索引)
+SHM_MAGIC = b'PDLS'
+SHM_LAYOUT_VERSION = 1
+SHM_HEADER = struct.Struct('<4sHHI')         # magic, 布局版本, 槽位数, 槽位大小
+SHM_HEADER_SIZE = 16
+SHM_SEQUENCE = struct.Struct('<I')           # seqlock版本号, 奇数表示正在写入
+SHM_PAYLOAD = struct.Struct('<BBBBIIddQ')    # 设备ID, 标志, 播放状态, 小节位置, 音轨ID, 节拍, BPM, Pitch, 更新时间(ns)
+SHM_SLOT_SIZE = 64
+SHM_FIELDS = ('deviceId', 'flags', 'playState', 'beatInMeasure', 'trackId', 'beat', 'bpm', 'pitch', 'updatedNs')
+
+SHM_FLAG_PLAYING = 0x01
+SHM_FLAG_MASTER = 0x02
+SHM_FLAG_SYNC = 0x04
+SHM_FLAG_ON_AIR = 0x08
+
+class SharedStatusTable:
+    """共享内存中的最新状态表 (写端)
+
+    每台设备占用一个固定槽位, 槽位首部是seqlock版本号: 写入前加一(变为奇数),
+    写完再加一。读端在版本号为偶数且读取前后一致时即得到完整快照, 无需加锁。
+    只有一个写线程 (STATUS监听线程)。
+    """
+
+    def __init__(self, name, slots=64):
+        from multiprocessing import shared_memory
+        size = SHM_HEADER_SIZE + slots * SHM_SLOT_SIZE
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 上次异常退出遗留的段
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.name = name
+        self.slots = slots
+        self.buffer = self.shm.buf
+        self.buffer[:size] = bytes(size)
+        SHM_HEADER.pack_into(self.buffer, 0, SHM_MAGIC, SHM_LAYOUT_VERSION, slots, SHM_SLOT_SIZE)
+
+    def write(self, status):
+        """写入一台设备的最新状态"""
+        device_id = status.get('deviceId', -1)
+        if not isinstance(device_id, int) or not 0 <= device_id < self.slots:
+            return
+        flags = ((SHM_FLAG_PLAYING if status.get('isPlaying') else 0)
+                 | (SHM_FLAG_MASTER if status.get('isMaster') else 0)
+                 | (SHM_FLAG_SYNC if status.get('isSync') else 0)
+                 | (SHM_FLAG_ON_AIR if status.get('isOnAir') else 0))
+
+        offset = SHM_HEADER_SIZE + device_id * SHM_SLOT_SIZE
+        sequence = SHM_SEQUENCE.unpack_from(self.buffer, offset)[0]
+        SHM_SEQUENCE.pack_into(self.buffer, offset, (sequence + 1) & 0xFFFFFFFF)
+        SHM_PAYLOAD.pack_into(
+            self.buffer, offset + SHM_SEQUENCE.size,
+            device_id, flags, status.get('playState', 0), status.get('beatInMeasure', 0),
+            status.get('trackId', 0) & 0xFFFFFFFF, status.get('beat', 0) & 0xFFFFFFFF,
+            status.get('bpm', 0.0), status.get('pitch', 0.0), time.monotonic_ns())
+        SHM_SEQUENCE.pack_into(self.buffer, offset, (sequence + 2) & 0xFFFFFFFF)
+
+    def close(self):
+        """释放并删除共享内存段"""
+        self.buffer.release()
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class SharedStatusReader:
+    """共享内存状态表读端 - 无锁轮询, 直接从共享缓冲区解包"""
+
+    def __init__(self, name, max_retries=10000):
+        from multiprocessing import shared_memory
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: 避免resource_tracker在读端退出时删除共享段
+            self.shm = shared_memory.SharedMemory(name=name)
+            try:
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(self.shm._name, 'shared_memory')
+            except Exception:
+                pass
+
+        self.buffer = self.shm.buf
+        magic, layout, self.slots, slot_size = SHM_HEADER.unpack_from(self.buffer, 0)
+        if magic != SHM_MAGIC or layout != SHM_LAYOUT_VERSION or slot_size != SHM_SLOT_SIZE:
+            self.close()
+            raise ValueError(f"Shared memory segment '{name}' has an unknown layout")
+        self.max_retries = max_retries
+        self.retries = 0
+        self.abandoned = 0  # 重试耗尽的读取次数
+
+    def read_raw(self, device_id):
+        """读取一个槽位, 返回字段元组 (见SHM_FIELDS)
+
+        从未写入, 或重试max_retries次仍读不到一致数据 (例如写端在写入中途
+        退出, 版本号停留在奇数) 时返回None。
+        """
+        offset = SHM_HEADER_SIZE + device_id * SHM_SLOT_SIZE
+        buffer = self.buffer
+        for _ in range(self.max_retries):
+            before = SHM_SEQUENCE.unpack_from(buffer, offset)[0]
+            if before == 0:
+                return None
+            if not before & 1:
+                values = SHM_PAYLOAD.unpack_from(buffer, offset + SHM_SEQUENCE.size)
+                if SHM_SEQUENCE.unpack_from(buffer, offset)[0] == before:
+                    return values
+            self.retries += 1
+        self.abandoned += 1
+        return None
+
+    def read(self, device_id):
+        """读取一台设备的状态字典"""
+        values = self.read_raw(device_id)
+        if values is None:
+            return None
+        status = dict(zip(SHM_FIELDS, values))
+        flags = status['flags']
+        status['isPlaying'] = bool(flags & SHM_FLAG_PLAYING)
+        status['isMaster'] = bool(flags & SHM_FLAG_MASTER)
+        status['isSync'] = bool(flags & SHM_FLAG_SYNC)
+        status['isOnAir'] = bool(flags & SHM_FLAG_ON_AIR)
+        return status
+
+    def snapshot(self):
+        """读取所有已写入的槽位"""
+        result = {}
+        for device_id in range(self.slots):
+            status = self.read(device_id)
+            if status is not None:
+                result[device_id] = status
+        return result
+
+    def close(self):
+        """断开共享内存 (不删除)"""
+        self.buffer.release()
+        self.shm.close()
+
+def _shared_memory_read_loop(name, reads):
+    """在独立进程中连续读取槽位1, 打印耗时与重试次数"""
+    reader = SharedStatusReader(name)
+    try:
+        read_raw = reader.read_raw
+        started = time.perf_counter()
+        for _ in range(reads):
+            read_raw(1)
+        print(time.perf_counter() - started, reader.retries)
+    finally:
+        reader.close()
+
+def benchmark_shared_memory(reads=1000000, write_rate=1000.0):
+    """共享内存读吞吐基准: 本进程以固定频率写入, 另一进程连续轮询"""
+    import subprocess
+    name = f"prodjlink_bench_{os.getpid()}"
+    table = SharedStatusTable(name)
+    stop = threading.Event()
+
+    def writer():
+        beat = 0
+        while not stop.is_set():
+            beat += 1
+            table.write({'deviceId': 1, 'beat': beat, 'beatInMeasure': beat % 4 + 1,
+                         'bpm': 128.0, 'pitch': 0.0, 'isPlaying': True})
+            time.sleep(1.0 / write_rate)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    try:
+        output = subprocess.check_output(
+            [sys.executable, '-c', f"import {module}; {module}._shared_memory_read_loop({name!r}, {reads})"],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+    finally:
+        stop.set()
+        thread.join()
+        table.close()
+
+    elapsed, retries = output.split()
+    elapsed = float(elapsed)
+    print(f"[BENCH] shared memory reads: {reads} in {elapsed * 1000:.1f} ms "
+          f"({reads / elapsed / 1e6:.2f} M reads/s, {elapsed / reads * 1e9:.0f} ns/read, "
+          f"{retries.decode()} seqlock retries, writer at {write_rate:.0f} Hz)")
+    return 0
+
+_CURRENT = object()  # bar_position() 的默认参数: 读取时钟的当前状态
+
+class BeatClock:
+    """主控设备的节拍时钟 - 根据最新STATUS推算任意时刻的节拍相位
+
+    STATUS监听线程调用 update(); 其他线程通过 snapshot() 读取一个不可变元组,
+    元组整体替换, 读写之间不需要加锁。
+    """
+
+    def __init__(self):
+        self.master_id = None
+        self.last_packet_time = 0.0
+        self.state = None  # (device_id, beat, beat_time, bpm, playing, on_air)
+
+    def update(self, status, now=None):
+        """用一条设备状态更新时钟"""
+        device_id = status.get('deviceId')
+        if status.get('isMaster'):
+            self.master_id = device_id
+        elif device_id == self.master_id:
+            self.master_id = None
+            self.state = None
+            return
+        if device_id != self.master_id:
+            return
+
+        if now is None:
+            now = time.monotonic()
+        bpm = status.get('bpm', 0.0) * (1.0 + status.get('pitch', 0.0) / 100.0)
+        beat = status.get('beat', 0)
+        previous = self.state
+        if previous is None or previous[0] != device_id or bpm <= 0:
+            beat_time = now
+        elif previous[1] == beat:
+            beat_time = previous[2]
+        else:
+            # 节拍发生在上一个包与本包之间: 优先沿用预测的节拍网格, 超出该区间时才修正
+            beat_time = previous[2] + (beat - previous[1]) * 60.0 / bpm
+            beat_time = min(max(beat_time, self.last_packet_time), now)
+        self.last_packet_time = now
+        self.state = (device_id, beat, beat_time, bpm, status.get('isPlaying', False),
+                      status.get('isOnAir', False))
+
+    def snapshot(self):
+        """返回 (device_id, beat, beat_time, bpm, playing, on_air), 没有主控设备时返回None"""
+        return self.state
+
+    def bar_position(self, now=None, state=_CURRENT):
+        """返回小节内的位置 [0, 4), 主控设备未播放时返回None
+
+        state为调用方已取得的snapshot() (可以是None), 用于与其他字段保持一致;
+        省略时读取当前状态。
+        """
+        if state is _CURRENT:
+            state = self.state
+        if state is None or not state[4] or state[3] <= 0:
+            return None
+        if now is None:
+            now = time.monotonic()
+        # 相位最多外推到下一拍之前, 等待下一个STATUS确认
+        fraction = min(max((now - state[2]) * state[3] / 60.0, 0.0), 0.999)
+        return state[1] % 4 + fraction
+
+ARTNET_PORT = 6454
+ARTNET_OP_DMX = 0x5000
+ARTNET_PROTOCOL_VERSION = 14
+ARTNET_DMX_HEADER = struct.Struct('<8sHBBBBHBB')  # ID, OpCode(LE), 协议版本(高,低), 序号, 物理端口, universe(LE), 长度(高,低)
+DMX_UNIVERSE_SIZE = 512
+
+class ArtNetOutput:
+    """节拍同步的Art-Net (DMX over UDP) 输出引擎
+
+    按固定帧率从主控设备的节拍相位选择预先计算好的效果帧, 拷贝到预分配的
+    ArtDmx包缓冲区后发送; 每帧不分配新的缓冲区。记录每帧相对理想发送时刻
+    的抖动。
+    """
+
+    EFFECTS = ('pulse', 'chase', 'bar')
+
+    def __init__(self, clock, target='255.255.255.255', port=ARTNET_PORT, universe=0,
+                 fixtures=8, channels_per_fixture=1, fps=40.0, effect='pulse',
+                 steps_per_beat=32, require_on_air=False, jitter_samples=2048):
+        if effect not in self.EFFECTS:
+            raise ValueError(f"Unknown Art-Net effect '{effect}', expected one of {self.EFFECTS}")
+
+        self.clock = clock
+        self.address = (target, port)
+        self.fps = fps
+        self.period = 1.0 / fps
+        self.effect = effect
+        self.steps_per_beat = steps_per_beat
+        self.require_on_air = require_on_air
+        self.channel_count = fixtures * channels_per_fixture
+        self.running = False
+        self.thread = None
+        self.sock = None
+
+        # 预分配每个universe的ArtDmx包
+        self.packets = []
+        self.spans = []
+        for index in range((self.channel_count + DMX_UNIVERSE_SIZE - 1) // DMX_UNIVERSE_SIZE):
+            start = index * DMX_UNIVERSE_SIZE
+            length = min(DMX_UNIVERSE_SIZE, self.channel_count - start)
+            length += length & 1  # DMX数据长度必须为偶数
+            packet = bytearray(ARTNET_DMX_HEADER.size + length)
+            ARTNET_DMX_HEADER.pack_into(packet, 0, b'Art-Net\x00', ARTNET_OP_DMX, 0,
+                                        ARTNET_PROTOCOL_VERSION, 0, 0, universe + index,
+                                        length >> 8, length & 0xFF)
+            self.packets.append(packet)
+            self.spans.append((start, length))
+        self.packet_views = [memoryview(packet) for packet in self.packets]
+
+        # 预计算一个小节内所有步进的效果帧, 以及每帧每个universe的切片
+        self.frames = self.render_frames(fixtures, channels_per_fixture)
+        self.idle_frame = self.slice_frame(bytearray(self.frame_size()))
+        self.sequence = 0
+
+        # 抖动统计 (预分配环形缓冲)
+        from array import array
+        self.jitter = array('d', bytes(8 * jitter_samples))
+        self.jitter_count = 0
+        self.jitter_max = 0.0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    def frame_size(self):
+        """所有universe数据区的总长度 (含补齐字节)"""
+        return sum(length for _, length in self.spans)
+
+    def slice_frame(self, frame):
+        """把一帧数据切成每个universe的memoryview"""
+        view = memoryview(bytes(frame))
+        slices = []
+        offset = 0
+        for _, length in self.spans:
+            slices.append(view[offset:offset + length])
+            offset += length
+        return slices
+
+    def intensity(self, fixture, fixtures, beat_index, fraction):
+        """计算某个灯具在给定节拍位置的亮度 (0-255)"""
+        decay = (1.0 - fraction) ** 2
+        if self.effect == 'pulse':
+            level = 1.0 if beat_index == 0 else 0.6
+            return int(255 * level * decay)
+        if self.effect == 'chase':
+            return int(255 * decay) if fixture % 4 == beat_index else 0
+        # bar: 小节第一拍全亮, 其余拍只亮奇偶交替的灯具
+        if beat_index == 0:
+            return int(255 * decay)
+        return int(96 * decay) if fixture % 2 == beat_index % 2 else 0
+
+    def render_frames(self, fixtures, channels_per_fixture):
+        """预计算一个小节 (4拍) 的全部效果帧"""
+        frames = []
+        for step in range(4 * self.steps_per_beat):
+            beat_index, substep = divmod(step, self.steps_per_beat)
+            fraction = substep / self.steps_per_beat
+            frame = bytearray(self.frame_size())
+            for fixture in range(fixtures):
+                level = self.intensity(fixture, fixtures, beat_index, fraction)
+                for channel in range(channels_per_fixture):
+                    absolute = fixture * channels_per_fixture + channel
+                    universe, offset = divmod(absolute, DMX_UNIVERSE_SIZE)
+                    frame[sum(length for _, length in self.spans[:universe]) + offset] = level
+            frames.append(self.slice_frame(frame))
+        return frames
+
+    def current_frame(self, now):
+        """根据节拍时钟选择当前帧"""
+        # 只读取一次状态, 相位与on-air标志来自同一个快照
+        state = self.clock.snapshot()
+        if state is None:
+            return self.idle_frame
+        position = self.clock.bar_position(now, state)
+        if position is None:
+            return self.idle_frame
+        if self.require_on_air and not state[5]:
+            return self.idle_frame
+        return self.frames[int(position * self.steps_per_beat) % len(self.frames)]
+
+    def send_frame(self, frame):
+        """把帧数据拷贝进预分配的包并发送"""
+        self.sequence = self.sequence % 255 + 1  # 0表示禁用序号
+        for packet, view, data in zip(self.packets, self.packet_views, frame):
+            packet[12] = self.sequence
+            view[ARTNET_DMX_HEADER.size:] = data
+            self.sock.sendto(packet, self.address)
+        self.frames_sent += 1
+
+    def record_jitter(self, lateness):
+        """记录一帧的发送延迟"""
+        self.jitter[self.jitter_count % len(self.jitter)] = lateness
+        self.jitter_count += 1
+        if lateness > self.jitter_max:
+            self.jitter_max = lateness
+
+    def run(self):
+        """输出线程: 按固定帧率发送"""
+        next_time = time.monotonic()
+        while self.running:
+            next_time += self.period
+            remaining = next_time - time.monotonic()
+            if remaining > 0.002:
+                time.sleep(remaining - 0.002)
+            while time.monotonic() < next_time:
+                pass
+            now = time.monotonic()
+            lateness = now - next_time
+            self.record_jitter(lateness)
+            try:
+                self.send_frame(self.current_frame(now))
+            except OSError as e:
+                logger.error(f"Art-Net send error: {e}")
+            except Exception:
+                # 输出线程不能退出, 记录后继续下一帧
+                logger.exception("Art-Net frame error")
+            if lateness > self.period:
+                # 严重落后时丢弃错过的帧, 重新对齐
+                skipped = int(lateness / self.period)
+                self.frames_skipped += skipped
+                next_time += skipped * self.period
+
+    def start(self):
+        """启动输出线程"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='artnet-output', daemon=True)
+        self.thread.start()
+        logger.info(f"Art-Net output to {self.address[0]}:{self.address[1]}, "
+                    f"{len(self.packets)} universe(s), {self.fps:.0f} fps, effect '{self.effect}'")
+
+    def stop(self):
+        """停止输出线程并关闭套接字"""
+        self.running = False
+        if self.thread:
+            self.thread.join(1.0)
+        if self.sock:
+            self.sock.close()
+
+    def jitter_report(self):
+        """返回相对目标帧周期的抖动统计 (毫秒)"""
+        count = min(self.jitter_count, len(self.jitter))
+        samples = sorted(self.jitter[:count])
+        if not samples:
+            return {'frames': 0}
+        return {
+            'frames': self.frames_sent,
+            'skipped': self.frames_skipped,
+            'targetPeriodMs': round(self.period * 1000, 3),
+            'meanMs': round(sum(samples) / count * 1000, 3),
+            'p50Ms': round(samples[count // 2] * 1000, 3),
+            'p99Ms': round(samples[min(count - 1, int(count * 0.99))] * 1000, 3),
+            'maxMs': round(self.jitter_max * 1000, 3),
+        }
+
+def osc_pad(data):
+    """OSC字符串以NUL结尾并补齐到4字节"""
+    return data + b'\x00' * (4 - len(data) % 4)
+
+def osc_prefix(address, type_tags):
+    """预编码OSC消息的地址与类型标签部分"""
+    return osc_pad(address.encode('ascii')) + osc_pad((',' + type_tags).encode('ascii'))
+
+class BeatScheduler:
+    """高精度节拍事件调度器 - 提前预测节拍时刻并按时发送OSC事件
+
+    根据主控设备的速度与相位计算下一个事件的理想时刻, 扣除配置的输出延迟后,
+    先粗略睡眠再在最后约1ms内自旋等待, 在单调高精度时钟上准时发送。可选每拍
+    24个时钟脉冲 (MIDI时钟风格)。记录每个事件的脉冲序号和相对预定时刻的唤醒
+    误差; 已知真实节拍时刻时 (基准测试), 报告还给出相对真实节拍网格的误差。
+    """
+
+    PPQN = 24
+    BEAT_PREFIX = osc_prefix('/beat', 'if')   # 小节内位置, BPM
+    BAR_PREFIX = osc_prefix('/bar', 'i')      # 节拍计数器 / 4
+    CLOCK_PREFIX = osc_prefix('/clock', 'i')  # 拍内脉冲序号 0-23
+    BEAT_ARGS = struct.Struct('>if')
+    INT_ARG = struct.Struct('>i')
+
+    def __init__(self, clock, targets, clock_ticks=False, output_latency=0.0,
+                 spin_threshold=0.001, report_samples=4096):
+        self.clock = clock
+        self.targets = list(targets)
+        self.ticks_per_beat = self.PPQN if clock_ticks else 1
+        self.output_latency = output_latency
+        self.spin_threshold = spin_threshold
+        self.running = False
+        self.thread = None
+        self.sock = None
+        self.last_tick = None
+
+        # 预分配的事件记录 (脉冲序号, 预定发送时刻, 唤醒误差)
+        from array import array
+        self.ticks = array('q', bytes(8 * report_samples))
+        self.ideal_times = array('d', bytes(8 * report_samples))
+        self.errors = array('d', bytes(8 * report_samples))
+        self.events = 0
+
+    def next_event(self, state, now):
+        """计算下一个事件的绝对脉冲序号和理想时刻 (听到的时刻)"""
+        _, beat, beat_time, bpm, _, _ = state
+        tick_period = 60.0 / bpm / self.ticks_per_beat
+        anchor = beat * self.ticks_per_beat
+        # 发送时刻 = 理想时刻 - 输出延迟, 因此按 now + 延迟 查找下一个脉冲
+        elapsed = int((now + self.output_latency - beat_time) // tick_period) + 1
+        tick = anchor + max(elapsed, 0)
+        if self.last_tick is not None and tick <= self.last_tick:
+            if self.last_tick - tick <= 2 * self.ticks_per_beat:
+                tick = self.last_tick + 1
+            # 计数器大幅回退 (重新定位/换歌) 时直接跟随
+        return tick, beat_time + (tick - anchor) * tick_period
+
+    def emit(self, tick, bpm):
+        """发送一个脉冲对应的OSC事件"""
+        packets = []
+        if self.ticks_per_beat > 1:
+            packets.append(self.CLOCK_PREFIX + self.INT_ARG.pack(tick % self.ticks_per_beat))
+        if tick % self.ticks_per_beat == 0:
+            beat = tick // self.ticks_per_beat
+            packets.append(self.BEAT_PREFIX + self.BEAT_ARGS.pack(beat % 4 + 1, bpm))
+            if beat % 4 == 0:
+                packets.append(self.BAR_PREFIX + self.INT_ARG.pack((beat // 4) & 0x7FFFFFFF))
+        for packet in packets:
+            for target in self.targets:
+                self.sock.sendto(packet, target)
+
+    def run(self):
+        """调度线程"""
+        while self.running:
+            state = self.clock.snapshot()
+            if state is None or not state[4] or state[3] <= 0:
+                self.last_tick = None
+                time.sleep(0.005)
+                continue
+
+            now = time.monotonic()
+            tick, ideal = self.next_event(state, now)
+            send_at = ideal - self.output_latency
+            remaining = send_at - now
+            if remaining > self.spin_threshold:
+                # 分段睡眠, 期间若收到新的状态会重新计算
+                time.sleep(min(remaining - self.spin_threshold, 0.005))
+                continue
+            while time.monotonic() < send_at:
+                pass
+
+            sent = time.monotonic()
+            try:
+                self.emit(tick, state[3])
+            except OSError as e:
+                logger.error(f"OSC send error: {e}")
+            self.last_tick = tick
+            index = self.events % len(self.errors)
+            self.ticks[index] = tick
+            self.ideal_times[index] = send_at
+            self.errors[index] = sent - send_at
+            self.events += 1
+
+    def start(self):
+        """启动调度线程"""
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='beat-scheduler', daemon=True)
+        self.thread.start()
+        logger.info(f"Beat scheduler sending OSC to {len(self.targets)} target(s), "
+                    f"{self.ticks_per_beat} tick(s) per beat, latency compensation "
+                    f"{self.output_latency * 1000:.1f} ms")
+
+    def stop(self):
+        """停止调度线程"""
+        self.running = False
+        if self.thread:
+            self.thread.join(1.0)
+        if self.sock:
+            self.sock.close()
+
+    def report(self, true_time=None):
+        """误差报告
+
+        wakeup: 实际发送相对预定时刻的误差, 只反映线程唤醒精度。
+        grid:   提供 true_time(tick) -> 该脉冲真实被听到的时刻 时, 实际听到的
+                时刻 (发送 + 输出延迟) 相对真实节拍网格的误差, 包含相位推算误差。
+        """
+        count = min(self.events, len(self.errors))
+        if count == 0:
+            return {'events': 0}
+        ideal = self.ideal_times[:count]
+        errors = self.errors[:count]
+        report = {'events': self.events, 'wakeup': timing_stats(ideal, errors)}
+        if true_time is not None:
+            heard = [t + e + self.output_latency for t, e in zip(ideal, errors)]
+            grid_errors = [h - true_time(tick) for h, tick in zip(heard, self.ticks[:count])]
+            report['grid'] = timing_stats(heard, grid_errors)
+        return report
+
+def timing_stats(times, errors):
+    """误差分位数 (ms, 按绝对值) 与误差随时间的线性趋势 (us/s)"""
+    count = len(errors)
+    ordered = sorted(abs(error) for error in errors)
+    mean_error = sum(errors) / count
+
+    drift = 0.0
+    if count > 1:
+        mean_time = sum(times) / count
+        variance = sum((t - mean_time) ** 2 for t in times)
+        if variance > 0:
+            covariance = sum((t - mean_time) * (e - mean_error) for t, e in zip(times, errors))
+            drift = covariance / variance
+
+    return {
+        'meanMs': round(mean_error * 1000, 4),
+        'p50Ms': round(ordered[count // 2] * 1000, 4),
+        'p99Ms': round(ordered[min(count - 1, int(count * 0.99))] * 1000, 4),
+        'maxMs': round(ordered[-1] * 1000, 4),
+        'driftUsPerSec': round(drift * 1e6, 3),
+    }
+
+def benchmark_scheduler(seconds=10.0, bpm=128.0, clock_ticks=True, packet_offset=0.15):
+    """调度器基准: 模拟主控设备, 向本机UDP接收端发送事件并输出报告
+
+    模拟设备的第一个STATUS包在第1拍之后packet_offset秒到达, 之后每200ms一个,
+    与节拍不对齐; 报告中的grid误差相对模拟设备的真实节拍时刻计算。
+    """
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    sink.setblocking(False)
+
+    clock = BeatClock()
+    scheduler = BeatScheduler(clock, [sink.getsockname()], clock_ticks=clock_ticks)
+    period = 60.0 / bpm
+    started = time.monotonic()
+    first_beat = started - packet_offset  # 第1拍的真实时刻
+
+    def true_time(tick):
+        return first_beat + (tick / scheduler.ticks_per_beat - 1) * period
+
+    scheduler.start()
+    received = 0
+    try:
+        while time.monotonic() - started < seconds:
+            # 模拟每200ms一个STATUS包
+            now = time.monotonic()
+            beat = 1 + int((now - first_beat) / period)
+            clock.update({'deviceId': 1, 'isMaster': True, 'isPlaying': True, 'bpm': bpm, 'beat': beat}, now)
+            time.sleep(0.2)
+            while True:
+                try:
+                    sink.recv(64)
+                    received += 1
+                except BlockingIOError:
+                    break
+    finally:
+        scheduler.stop()
+        sink.close()
+
+    report = scheduler.report(true_time)
+    print(f"[BENCH] scheduler at {bpm} BPM for {seconds:.0f} s, status packets {packet_offset * 1000:.0f} ms "
+          f"after the beat, {received} packets received")
+    print(f"[BENCH] error vs true beat grid: {report['grid']}")
+    print(f"[BENCH] timer wake-up error: {report['wakeup']}")
+    return 0
+
+class StateSnapshot:
+    """设备表与最新状态的快照 - 每个版本只序列化和压缩一次
+
+    状态每变化一次版本号加一; 第一次被请求时才生成JSON及其压缩版本, 之后同一
+    版本的所有请求共享这份数据, 携带相同ETag的条件请求直接返回304。
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self.asset = None
+        self.asset_version = -1
+
+    def touch(self):
+        """标记状态已变化"""
+        self.version += 1
+
+    def etag(self):
+        """当前版本的ETag"""
+        return f'"{self.epoch}-{self.version}"'
+
+    def current(self):
+        """返回当前版本的预压缩资源"""
+        if self.asset_version != self.version:
+            body = json.dumps({
+                'version': self.version,
+                'devices': list(self.server.devices.values()),
+                'status': list(self.server.current_status.values()),
+            }, separators=(',', ':'))
+            self.asset = PrecompressedAsset(body, 'application/json', cache_control='no-cache',
+                                            etag=self.etag(), gzip_level=5, brotli_quality=None,
+                                            min_compress_size=1024)
+            self.asset_version = self.version
+        return self.asset
+
+    def response(self, request_headers):
+        """生成 (status, headers, body)"""
+        return self.current().response(request_headers)
+
+# 热重启快照文件: 固定表头 + zlib压缩的JSON
+WARM_MAGIC = b'PDLW'
+WARM_FORMAT_VERSION = 1
+WARM_HEADER = struct.Struct('<4sHHIId')  # magic, 格式版本, 保留, 负载长度, CRC32, 保存时间
+
+class WarmSnapshot:
+    """热重启快照 - 定期把设备表、最新状态和hub场地进度写入磁盘
+
+    先写同目录的临时文件并fsync, 再用os.replace原子替换, 崩溃时磁盘上只会有
+    完整的旧快照或新快照。状态版本未变化时跳过写入。启动时以mmap读取并校验,
+    恢复的条目标记为provisional, 被实时数据包替换即视为确认; 超过期限仍未
+    确认的设备会被删除并通知客户端。
+    """
+
+    def __init__(self, path, interval=5.0, provisional_ttl=30.0):
+        self.path = path
+        self.interval = interval
+        self.provisional_ttl = provisional_ttl
+        self.saved_version = None
+        self.stats = {'saves': 0, 'skipped': 0, 'bytes': 0}
+
+    def encode(self, server):
+        """把当前状态编码为快照文件内容 (在事件循环中调用)"""
+        payload = json.dumps({
+            'devices': list(server.devices.items()),
+            'status': list(server.current_status.items()),
+            'hub': server.hub.venues if server.hub else None,
+        }, separators=(',', ':')).encode('utf-8')
+        body = zlib.compress(payload, 6)
+        return WARM_HEADER.pack(WARM_MAGIC, WARM_FORMAT_VERSION, 0, len(body),
+                                zlib.crc32(body), time.time()) + body
+
+    def write(self, data):
+        """原子写入快照文件"""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        if hasattr(os, 'O_DIRECTORY'):
+            # 同步目录项, 保证替换在掉电后仍然有效
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+    async def checkpoint(self, server):
+        """状态有变化时写入快照, 文件IO在线程池中执行"""
+        version = server.state_snapshot.version
+        if version == self.saved_version:
+            self.stats['skipped'] += 1
+            return False
+        data = self.encode(server)
+        await asyncio.get_running_loop().run_in_executor(None, self.write, data)
+        self.saved_version = version
+        self.stats['saves'] += 1
+        self.stats['bytes'] = len(data)
+        return True
+
+    def load(self):
+        """读取并校验快照, 文件不存在或已损坏时返回None"""
+        import mmap
+        try:
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                magic, version, _, length, checksum, saved_at = WARM_HEADER.unpack_from(view)
+                body = view[WARM_HEADER.size:WARM_HEADER.size + length]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning(f"Cannot read snapshot {self.path}: {e}")
+            return None
+
+        if magic != WARM_MAGIC or version != WARM_FORMAT_VERSION or len(body) != length \
+                or zlib.crc32(body) != checksum:
+            logger.warning(f"Ignoring invalid snapshot {self.path}")
+            return None
+        try:
+            payload = json.loads(zlib.decompress(body))
+        except (zlib.error, ValueError) as e:
+            logger.warning(f"Ignoring invalid snapshot {self.path}: {e}")
+            return None
+        payload['saved_at'] = saved_at
+        return payload
+
+    def restore(self, server):
+        """把快照中的条目以provisional状态载入服务器, 返回恢复的条目数"""
+        payload = self.load()
+        if not payload:
+            return 0
+        restored = 0
+        for table, entries in ((server.devices, payload['devices']), (server.current_status, payload['status'])):
+            for key, entry in entries:
+                entry['provisional'] = True
+                table[key] = entry
+                restored += 1
+        if server.hub and payload.get('hub'):
+            server.hub.venues = payload['hub']
+        server.state_snapshot.touch()
+        logger.info(f"Restored {len(payload['devices'])} devices and {len(payload['status'])} statuses "
+                    f"from snapshot saved {time.time() - payload['saved_at']:.1f}s ago")
+        return restored
+
+    def expire(self, server):
+        """删除仍未被实时数据确认的条目, 返回要广播的删除消息"""
+        messages = []
+        for key, device in list(server.devices.items()):
+            if device.get('provisional') and server.devices.pop(key, None) is not None:
+                messages.append({'type': 'remove', 'device': device})
+        for key, status in list(server.current_status.items()):
+            if status.get('provisional'):
+                server.current_status.pop(key, None)
+        if messages:
+            server.state_snapshot.touch()
+            logger.info(f"Removed {len(messages)} devices not confirmed within {self.provisional_ttl:.0f}s")
+        return messages
+
+class StateAPIServer:
+    """只读HTTP状态接口与Server-Sent Events变化流
+
+    GET /state  返回当前快照, 支持ETag条件请求 (304)
+    GET /events 以SSE推送变化; 每条消息只编码一次, 所有订阅者共享同一份字节
+    """
+
+    def __init__(self, server, host, port, heartbeat=15.0, queue_size=256):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        self.subscribers = {}  # queue -> writer
+        self.connections = {}  # 连接处理任务 -> writer
+        self.tcp_server = None
+
+    async def start(self):
+        """开始监听"""
+        self.tcp_server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"State API running: http://{self.host}:{self.port}/state (SSE: /events)")
+
+    async def close(self):
+        """停止监听并结束所有keep-alive连接与SSE流"""
+        if self.tcp_server:
+            self.tcp_server.close()
+        tasks = list(self.connections)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.tcp_server:
+            await self.tcp_server.wait_closed()
+
+    def publish(self, message, message_json):
+        """向所有SSE订阅者推送一条消息"""
+        if not self.subscribers:
+            return
+        frame = (f"id: {self.server.state_snapshot.version}\n"
+                 f"event: {message.get('type', 'message')}\n"
+                 f"data: {message_json}\n\n").encode('utf-8')
+        for queue, writer in list(self.subscribers.items()):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # 跟不上的订阅者直接断开, 重连后会先收到完整快照
+                del self.subscribers[queue]
+                writer.transport.abort()
+
+    async def read_request(self, reader):
+        """读取请求行与请求头, 连接关闭时返回None"""
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            return None
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split()
+        if len(parts) != 3:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(':')
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return parts[0], parts[1], parts[2], headers
+
+    def write_response(self, writer, status, headers, body, keep_alive):
+        """写出一个完整的HTTP响应"""
+        lines = [f"HTTP/1.1 {status.value} {status.phrase}"]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+
+    async def handle(self, reader, writer):
+        """处理一个HTTP连接 (支持keep-alive)"""
+        task = asyncio.current_task()
+        self.connections[task] = writer
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, version, headers = request
+                path = target.split('?', 1)[0]
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                if method not in ('GET', 'HEAD'):
+                    self.write_response(writer, HTTPStatus.METHOD_NOT_ALLOWED, [('Allow', 'GET, HEAD')], b'', keep_alive)
+                elif path == '/events':
+                    await self.stream_events(writer)
+                    break
+                elif path == '/state':
+                    status, response_headers, body = self.server.state_snapshot.response(headers)
+                    self.write_response(writer, status, response_headers, b'' if method == 'HEAD' else body, keep_alive)
+                else:
+                    self.write_response(writer, HTTPStatus.NOT_FOUND, [('Content-Type', 'text/plain')],
+                                        b'Not Found\n', keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # 关闭时被取消属于正常结束
+            pass
+        finally:
+            self.connections.pop(task, None)
+            writer.close()
+
+    async def stream_events(self, writer):
+        """SSE推送: 先发送完整快照, 之后逐条推送变化"""
+        writer.write(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: text/event-stream\r\n'
+                     b'Cache-Control: no-cache\r\n'
+                     b'Connection: keep-alive\r\n\r\n')
+        snapshot = self.server.state_snapshot
+        writer.write(b'id: ' + str(snapshot.version).encode() + b'\nevent: snapshot\ndata: '
+                     + snapshot.current().variants['identity'] + b'\n\n')
+        await writer.drain()
+
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers[queue] = writer
+        try:
+            while True:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), timeout=self.heartbeat)
+                except asyncio.TimeoutError:
+                    frame = b': keep-alive\n\n'
+                writer.write(frame)
+                await writer.drain()
+        finally:
+            self.subscribers.pop(queue, None)
+
+# Linux内核接收时间戳 (struct timespec, 纳秒精度)
+SO_TIMESTAMPNS = getattr(socket, 'SO_TIMESTAMPNS', 35 if sys.platform.startswith('linux') else None)
+TIMESPEC = struct.Struct('@qq')
+
+class LatencyTracer:
+    """端到端延迟追踪 - 对抽样的数据包记录各处理阶段耗时
+
+    阶段: 内核接收 -> recvmsg返回 -> 解析完成 -> 广播循环取出 -> WebSocket发送,
+    以及客户端回显得到的"玻璃到玻璃"总延迟。所有时间戳均为 time.time_ns()
+    (与内核SO_TIMESTAMPNS同为实时时钟)。每个阶段使用预分配的环形缓冲, 只在
+    事件循环线程中写入。
+    """
+
+    STAGES = ('kernel_to_recv', 'recv_to_parsed', 'parsed_to_dequeued', 'dequeued_to_sent',
+              'kernel_to_sent', 'glass_to_glass')
+
+    def __init__(self, sample_every=100, samples=2048, pending_echoes=256):
+        from array import array
+        from itertools import count
+        self.sample_every = sample_every
+        self.counter = count()
+        self.trace_ids = count(1)
+        self.rings = {stage: array('d', bytes(8 * samples)) for stage in self.STAGES}
+        self.counts = dict.fromkeys(self.STAGES, 0)
+        self.origins = OrderedDict()  # trace_id -> 起点时间 (内核或用户态接收), 用于客户端回显
+        self.pending_echoes = pending_echoes
+
+    def maybe_trace(self, message, kernel_ns, recv_ns):
+        """按抽样率为消息附加追踪记录 (UDP线程调用)"""
+        if next(self.counter) % self.sample_every:
+            return
+        # [trace_id, 内核接收, 用户态接收, 解析完成, 取出]
+        message['_trace'] = [next(self.trace_ids), kernel_ns, recv_ns, time.time_ns(), 0]
+
+    def record(self, stage, nanoseconds):
+        """记录一个阶段的耗时"""
+        ring = self.rings[stage]
+        ring[self.counts[stage] % len(ring)] = nanoseconds / 1e6
+        self.counts[stage] += 1
+
+    def dequeued(self, message):
+        """广播循环取出消息时调用, 返回供客户端回显的追踪字段"""
+        trace = message.pop('_trace', None)
+        if trace is None:
+            return None
+        trace_id, kernel_ns, recv_ns, parsed_ns, _ = trace
+        trace[4] = time.time_ns()
+        if kernel_ns:
+            self.record('kernel_to_recv', recv_ns - kernel_ns)
+        self.record('recv_to_parsed', parsed_ns - recv_ns)
+        self.record('parsed_to_dequeued', trace[4] - parsed_ns)
+
+        self.origins[trace_id] = kernel_ns or recv_ns
+        if len(self.origins) > self.pending_echoes:
+            self.origins.popitem(last=False)
+        message['trace'] = {'id': trace_id, 'serverTs': trace[4] // 1000000}
+        return trace
+
+    def sent(self, trace):
+        """消息写入某个客户端连接后调用"""
+        now = time.time_ns()
+        self.record('dequeued_to_sent', now - trace[4])
+        self.record('kernel_to_sent', now - (trace[1] or trace[2]))
+
+    def echoed(self, trace_id, rtt):
+        """客户端渲染后回显追踪ID; 减去单程返回时间得到玻璃到玻璃延迟"""
+        origin = self.origins.pop(trace_id, None)
+        if origin is None:
+            return
+        one_way = (rtt or 0.0) / 2 if rtt != float('inf') else 0.0
+        self.record('glass_to_glass', time.time_ns() - origin - one_way * 1e9)
+
+    def summary(self):
+        """各阶段的百分位汇总 (毫秒)"""
+        result = {}
+        for stage in self.STAGES:
+            count = min(self.counts[stage], len(self.rings[stage]))
+            if not count:
+                continue
+            values = sorted(self.rings[stage][:count])
+            result[stage] = {
+                'samples': self.counts[stage],
+                'p50': round(values[count // 2], 3),
+                'p90': round(values[min(count - 1, int(count * 0.9))], 3),
+                'p99': round(values[min(count - 1, int(count * 0.99))], 3),
+                'max': round(values[-1], 3),
+            }
+        return result
+
+class JSONEndpoint:
+    """按需生成的JSON只读接口, 可挂到HTTP路由表"""
+
+    def __init__(self, producer):
+        self.producer = producer
+
+    def response(self, request_headers):
+        """生成 (status, headers, body)"""
+        body = json.dumps(self.producer()).encode('utf-8')
+        return HTTPStatus.OK, [('Content-Type', 'application/json'), ('Cache-Control', 'no-store')], body
+
+class ClientSession:
+    """单个WebSocket客户端的发送会话 - 按测得的延迟自适应更新频率与细节级别
+
+    广播只把已编码的消息放入本会话的待发送表 (同一设备/状态只保留最新一条),
+    由独立的发送任务写出, 慢客户端不会阻塞其他客户端。监测任务定期测量ping
+    往返时间和发送缓冲区占用: 落后时降低频率与细节, 恢复后逐级回到全速。
+    """
+
+    # (发送间隔秒, 是否发送分析等附加消息); 第0级为实时全量
+    RATE_LEVELS = ((0.0, True), (0.05, True), (0.1, True), (0.25, False), (0.5, False), (1.0, False))
+    DETAIL_TYPES = frozenset(['analytics'])
+    EVENT_TYPES = frozenset(['transition'])  # 事件消息: 逐条发送, 从不合并或丢弃
+
+    def __init__(self, websocket, high_water=64 * 1024, rtt_limit=0.25, probe_interval=2.0, tracer=None):
+        from itertools import count
+        self.websocket = websocket
+        self.tracer = tracer
+        self.high_water = high_water
+        self.rtt_limit = rtt_limit
+        self.probe_interval = probe_interval
+        self.level = 0
+        self.rtt = None
+        self.send_started = None  # 当前发送开始的时间, 用于判断发送是否被阻塞
+        self.pending = {}  # 插入顺序即发送顺序, 新值覆盖旧值但不改变位置
+        self.event_ids = count()
+        self.wakeup = asyncio.Event()
+        self.tasks = []
+
+    def offer(self, message, message_json, trace=None):
+        """加入一条待发送消息"""
+        message_type = message.get('type')
+        if message_type in self.DETAIL_TYPES and not self.RATE_LEVELS[self.level][1]:
+            return
+        key = state_key(message) or message_type
+        if message_type in self.EVENT_TYPES:
+            key = (message_type, next(self.event_ids))
+        elif message_type == 'remove':
+            # 删除消息取代该设备尚未发送的更新, 并排在之后到达的更新之前
+            device = message['device']
+            device_key = table_key(device, device['id'])
+            self.pending.pop(('device', device_key), None)
+            self.pending.pop(('status', device_key), None)
+            key = ('remove', device_key)
+            self.pending.pop(key, None)
+        self.pending[key] = (message_json, trace)
+        self.wakeup.set()
+
+    def start(self):
+        """启动发送与监测任务"""
+        self.tasks = [asyncio.create_task(self.sender()), asyncio.create_task(self.monitor())]
+
+    def stop(self):
+        """取消会话任务"""
+        for task in self.tasks:
+            task.cancel()
+
+    async def sender(self):
+        """按当前级别的间隔批量发送待发送消息"""
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                batch, self.pending = self.pending, {}
+                loop = asyncio.get_running_loop()
+                for message_json, trace in batch.values():
+                    self.send_started = loop.time()
+                    await self.websocket.send(message_json)
+                    if trace is not None:
+                        self.tracer.sent(trace)
+                self.send_started = None
+                interval = self.RATE_LEVELS[self.level][0]
+                if interval:
+                    await asyncio.sleep(interval)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def monitor(self):
+        """定期测量往返时间与发送缓冲区占用并调整级别"""
+        try:
+            while True:
+                await asyncio.sleep(self.probe_interval)
+                loop = asyncio.get_running_loop()
+                started = loop.time()
+                pong_waiter = await self.websocket.ping()
+                try:
+                    await asyncio.wait_for(pong_waiter, timeout=self.probe_interval)
+                    self.rtt = loop.time() - started
+                except asyncio.TimeoutError:
+                    self.rtt = float('inf')
+                transport = self.websocket.transport
+                buffered = transport.get_write_buffer_size() if transport else 0
+                stalled = loop.time() - self.send_started if self.send_started else 0.0
+                await self.adjust(max(self.rtt, stalled), buffered)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def adjust(self, rtt, buffered):
+        """根据测量的延迟 (往返时间或发送阻塞时长) 与缓冲区占用升降一级, 并通知客户端"""
+        level = self.level
+        if rtt > self.rtt_limit or buffered > self.high_water:
+            level = min(level + 1, len(self.RATE_LEVELS) - 1)
+        elif rtt < self.rtt_limit / 2 and buffered < self.high_water / 4:
+            level = max(level - 1, 0)
+        if level == self.level:
+            return
+
+        self.level = level
+        interval, detail = self.RATE_LEVELS[level]
+        logger.info(f"Client {self.websocket.remote_address}: rtt {rtt * 1000:.0f} ms, "
+                    f"buffered {buffered} bytes -> update interval {interval * 1000:.0f} ms")
+        self.offer({'type': 'rate'}, json.dumps({
+            'type': 'rate',
+            'rate': {'level': level, 'interval': interval, 'detail': 'full' if detail else 'reduced'}
+        }))
+
+FEED_FRAME = struct.Struct('>I')  # 采集进程 -> 前端工作进程: 4字节长度前缀 + JSON
+
+class IngestPublisher:
+    """采集进程的发布端 - 把已编码的更新一次性分发给各前端工作进程
+
+    每条消息只编码成一个帧, 依次写入每个工作进程的本机TCP连接; 工作进程
+    (重新)连接时先收到完整的设备表与状态快照。写缓冲区超过上限的连接会被
+    断开, 由工作进程重连并重新同步, 不会拖慢采集。
+    """
+
+    def __init__(self, server, host='127.0.0.1', port=0, max_buffer=8 * 1024 * 1024):
+        self.server = server
+        self.host = host
+        self.port = port
+        self.max_buffer = max_buffer
+        self.links = set()
+        self.linked = asyncio.Condition()
+        self.tcp_server = None
+
+    async def start(self):
+        """开始监听, 端口为0时由系统分配"""
+        self.tcp_server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.tcp_server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        """断开所有工作进程并停止监听"""
+        for writer in list(self.links):
+            writer.close()
+        if self.tcp_server:
+            self.tcp_server.close()
+            await self.tcp_server.wait_closed()
+
+    def frame(self, message_json):
+        """编码一个帧"""
+        payload = message_json.encode('utf-8')
+        return FEED_FRAME.pack(len(payload)) + payload
+
+    async def handle(self, reader, writer):
+        """处理一个工作进程连接"""
+        for kind, table in (('device', self.server.devices), ('status', self.server.current_status)):
+            for entry in list(table.values()):
+                writer.write(self.frame(json.dumps({'type': kind, kind: entry})))
+        self.links.add(writer)
+        async with self.linked:
+            self.linked.notify_all()
+        try:
+            await reader.read()  # 工作进程不发送数据, 读到EOF即断开
+        except (ConnectionError, asyncio.CancelledError):
+            # 关闭时被取消属于正常结束
+            pass
+        finally:
+            self.links.discard(writer)
+            writer.close()
+
+    async def wait_for_links(self, count, timeout):
+        """等待至少count个工作进程连接"""
+        async with self.linked:
+            await asyncio.wait_for(self.linked.wait_for(lambda: len(self.links) >= count), timeout)
+
+    def publish(self, message_json):
+        """把一条已编码的消息发给所有工作进程"""
+        if not self.links:
+            return
+        frame = self.frame(message_json)
+        for writer in list(self.links):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                logger.warning("Frontend worker is not keeping up, dropping its feed link")
+                self.links.discard(writer)
+                writer.transport.abort()
+                continue
+            writer.write(frame)
+
+def run_frontend_worker(options):
+    """前端工作进程入口: 只服务WebSocket/HTTP客户端, 数据来自采集进程"""
+    configure_console(options.get('log_level', logging.INFO))
+    server = ProDJLinkWebSocketServer(
+        websocket_port=options['port'],
+        host=options['host'],
+        debug_mode=False,
+        analytics_interval=0,
+        cache_max_age=options['cache_max_age'],
+        ingest_address=options['ingest_address'],
+    )
+    server.run()
+
+def _fanout_client(port, connections, ready, results):
+    """基准测试客户端进程: 建立若干连接, 统计收到的消息直到结束标记"""
+    async def client():
+        websocket = await websockets.connect(f'ws://127.0.0.1:{port}', compression=None)
+        received = 0
+        async for raw in websocket:
+            received += 1
+            if '"bench_end"' in raw:
+                break
+        await websocket.close()
+        return received, time.monotonic()
+
+    async def main():
+        tasks = []
+        for _ in range(connections):
+            tasks.append(asyncio.create_task(client()))
+            await asyncio.sleep(0.002)
+        ready.put(connections)
+        results.put(await asyncio.gather(*tasks))
+
+    asyncio.run(main())
+
+def benchmark_fanout(worker_counts=(1, 2, 4), clients=200, messages=2000, client_processes=4):
+    """扇出基准: 比较不同工作进程数下向所有客户端投递消息流的吞吐"""
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    print(f"[BENCH] {clients} clients, {messages} messages, {os.cpu_count()} CPU(s)")
+
+    for workers in worker_counts:
+        probe = socket.socket()
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+
+        ready = threading.Event()
+        server = ProDJLinkWebSocketServer(websocket_port=port, host='127.0.0.1', debug_mode=False,
+                                          analytics_interval=0, workers=workers)
+        server.on_ready = lambda _server: ready.set()
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        if not ready.wait(60):
+            print(f"[BENCH] workers={workers}: server did not become ready")
+            server.stop()
+            continue
+
+        ready_queue, results = context.Queue(), context.Queue()
+        processes = []
+        for index in range(client_processes):
+            share = clients // client_processes + (1 if index < clients % client_processes else 0)
+            process = context.Process(target=_fanout_client, args=(port, share, ready_queue, results))
+            process.start()
+            processes.append(process)
+        for _ in processes:
+            ready_queue.get(timeout=120)
+        time.sleep(0.5)
+
+        async def inject():
+            # 每条消息使用不同的键, 避免被客户端会话按设备合并, 测得的是实际投递量
+            for index in range(messages):
+                server.message_queue.put_nowait({'type': 'status', 'status': {'deviceId': index, 'beat': index}})
+                if index % 64 == 63:
+                    await asyncio.sleep(0)
+            server.message_queue.put_nowait({'type': 'bench_end'})
+            while not server.message_queue.empty():
+                await asyncio.sleep(0.001)
+
+        started = time.monotonic()
+        asyncio.run_coroutine_threadsafe(inject(), server.loop).result()
+        drained = time.monotonic() - started
+
+        delivered = 0
+        finished = started
+        for _ in processes:
+            for received, done_at in results.get(timeout=300):
+                delivered += received
+                finished = max(finished, done_at)
+        for process in processes:
+            process.join()
+        server.stop()
+        thread.join(10)
+
+        elapsed = finished - started
+        expected = clients * (messages + 1)
+        if delivered != expected:
+            print(f"[BENCH] workers={workers}: WARNING only {delivered} of {expected} messages delivered")
+        print(f"[BENCH] workers={workers}: delivered {delivered} messages in {elapsed * 1000:.0f} ms "
+              f"({delivered / elapsed:,.0f} msg/s), ingest queue drained in {drained * 1000:.1f} ms")
+    return 0
+
+def format_frame(frame):
+    """把一个栈帧格式化为 "函数 (文件:首行)", 同一函数的样本合并在一起"""
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class SamplingProfiler:
+    """统计采样CPU分析器 - 后台线程定期读取目标线程的调用栈
+
+    不使用sys.setprofile, 被分析的代码路径本身不受影响。结果为折叠栈格式
+    (每行 "线程;外层帧;...;内层帧 样本数"), 可直接交给flamegraph.pl或speedscope。
+    """
+
+    def __init__(self, thread_filter, interval=0.005):
+        self.thread_filter = thread_filter
+        self.interval = interval
+        self.counts = {}
+        self.samples = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """启动采样线程"""
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name='cpu-profiler', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止采样"""
+        self.running = False
+        if self.thread:
+            self.thread.join(1.0)
+            self.thread = None
+
+    def run(self):
+        """采样循环"""
+        while self.running:
+            targets = {thread.ident: thread.name for thread in threading.enumerate() if self.thread_filter(thread)}
+            for ident, frame in sys._current_frames().items():
+                name = targets.get(ident)
+                if name is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(format_frame(frame))
+                    frame = frame.f_back
+                stack.append(name)
+                key = ';'.join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+            time.sleep(self.interval)
+
+    def folded(self):
+        """导出折叠栈文本"""
+        return ''.join(f"{stack} {count}\n" for stack, count in sorted(self.counts.items())).encode('utf-8')
+
+class StallWatchdog:
+    """事件循环阻塞检测 - 心跳任务定期记录时间, 看门狗线程发现心跳超时即抓取事件循环线程的调用栈
+
+    阻塞期间事件循环无法自我报告, 因此由独立线程观察; 每次阻塞只记录一次,
+    心跳恢复后补上阻塞时长。
+    """
+
+    def __init__(self, threshold=0.1, history=256):
+        self.threshold = threshold
+        self.interval = max(threshold / 4, 0.005)
+        self.loop_ident = threading.get_ident()  # 在事件循环线程中创建
+        self.last_beat = time.monotonic()
+        self.stalls = deque(maxlen=history)
+        self.current = None
+        self.running = False
+        self.task = None
+        self.thread = None
+
+    def start(self):
+        """启动心跳任务与看门狗线程"""
+        self.running = True
+        self.last_beat = time.monotonic()
+        self.task = asyncio.create_task(self.heartbeat())
+        self.thread = threading.Thread(target=self.watch, name='stall-watchdog', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """停止检测"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        if self.thread:
+            self.thread.join(1.0)
+            self.thread = None
+
+    async def heartbeat(self):
+        """心跳任务"""
+        while True:
+            self.last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def watch(self):
+        """看门狗线程"""
+        while self.running:
+            time.sleep(self.interval)
+            last_beat = self.last_beat
+            if self.current is None:
+                if time.monotonic() - last_beat > self.interval + self.threshold:
+                    frame = sys._current_frames().get(self.loop_ident)
+                    stack = []
+                    while frame is not None:
+                        stack.append(format_frame(frame))
+                        frame = frame.f_back
+                    self.current = {'beat': last_beat, 'at': time.time(), 'stack': stack}
+            elif last_beat != self.current['beat']:
+                # 心跳已恢复, 记录本次阻塞
+                stall = self.current
+                stall['duration_ms'] = round((last_beat - stall.pop('beat') - self.interval) * 1000, 1)
+                self.stalls.append(stall)
+                self.current = None
+                where = stall['stack'][0] if stall['stack'] else 'unknown'
+                logger.warning(f"Event loop stalled for {stall['duration_ms']} ms in {where}")
+
+    def report(self):
+        """导出JSON报告"""
+        return json.dumps({
+            'threshold_ms': self.threshold * 1000,
+            'stalls': list(self.stalls),
+        }, indent=1).encode('utf-8')
+
+class RuntimeProfiler:
+    """按需运行时分析 - 通过带令牌的管理命令启动和停止
+
+    支持采样CPU分析 (事件循环线程与UDP监听线程)、tracemalloc内存快照和事件
+    循环阻塞检测。未启动时不创建任何线程或任务, 运行路径不受影响。结果保存在
+    内存中, 以标准格式通过 /admin/<文件名> 下载 (Authorization: Bearer <令牌>)。
+    """
+
+    ARTIFACTS = {
+        'cpu.folded': 'text/plain; charset=utf-8',
+        'allocations.tracemalloc': 'application/octet-stream',
+        'stalls.json': 'application/json',
+    }
+
+    def __init__(self, token):
+        self.token = token
+        self.cpu = None
+        self.watchdog = None
+        self.artifacts = {}  # 文件名 -> 内容
+
+    def authorized(self, token):
+        """校验管理令牌"""
+        return isinstance(token, str) and hmac.compare_digest(token.encode('utf-8'), self.token.encode('utf-8'))
+
+    async def execute(self, command, options):
+        """执行一条管理命令, 返回回复内容"""
+        handler = getattr(self, 'command_' + str(command).replace('-', '_'), None)
+        if handler is None:
+            return {'ok': False, 'error': f"unknown command: {command}"}
+        try:
+            return {'ok': True, **await handler(options)}
+        except (RuntimeError, ValueError, TypeError, OSError) as e:
+            return {'ok': False, 'error': str(e)}
+
+    async def command_status(self, options):
+        import tracemalloc
+        return {
+            'cpu': self.cpu is not None,
+            'alloc': tracemalloc.is_tracing(),
+            'stall': self.watchdog is not None,
+            'downloads': [f"/admin/{name}" for name in self.artifacts],
+        }
+
+    async def command_cpu_start(self, options):
+        if self.cpu:
+            raise RuntimeError("CPU profiler already running")
+        loop_ident = threading.get_ident()
+        self.cpu = SamplingProfiler(
+            lambda thread: thread.ident == loop_ident or thread.name.startswith('udp-'),
+            float(options.get('interval_ms', 5)) / 1000.0)
+        self.cpu.start()
+        logger.info("CPU sampling profiler started")
+        return {}
+
+    async def command_cpu_stop(self, options):
+        if not self.cpu:
+            raise RuntimeError("CPU profiler not running")
+        self.cpu.stop()
+        self.artifacts['cpu.folded'] = self.cpu.folded()
+        samples, stacks = self.cpu.samples, len(self.cpu.counts)
+        self.cpu = None
+        logger.info(f"CPU sampling profiler stopped ({samples} samples)")
+        return {'samples': samples, 'stacks': stacks, 'download': '/admin/cpu.folded'}
+
+    async def command_alloc_start(self, options):
+        import tracemalloc
+        if tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc already running")
+        tracemalloc.start(int(options.get('frames', 10)))
+        logger.info("tracemalloc started")
+        return {}
+
+    async def command_alloc_snapshot(self, options):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc not running")
+        # 快照和写文件较慢, 放到线程池中执行
+        data, top = await asyncio.get_running_loop().run_in_executor(None, self.take_allocation_snapshot)
+        self.artifacts['allocations.tracemalloc'] = data
+        return {'top': top, 'download': '/admin/allocations.tracemalloc'}
+
+    def take_allocation_snapshot(self):
+        """生成tracemalloc快照文件内容与前10个分配位置"""
+        import tempfile
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'allocations.tracemalloc')
+            snapshot.dump(path)
+            with open(path, 'rb') as f:
+                data = f.read()
+        return data, [str(stat) for stat in snapshot.statistics('lineno')[:10]]
+
+    async def command_alloc_stop(self, options):
+        import tracemalloc
+        tracemalloc.stop()
+        logger.info("tracemalloc stopped")
+        return {}
+
+    async def command_stall_start(self, options):
+        if self.watchdog:
+            raise RuntimeError("stall detection already running")
+        self.watchdog = StallWatchdog(float(options.get('threshold_ms', 100)) / 1000.0)
+        self.watchdog.start()
+        logger.info(f"Event loop stall detection started (threshold {self.watchdog.threshold * 1000:.0f} ms)")
+        return {}
+
+    async def command_stall_stop(self, options):
+        if not self.watchdog:
+            raise RuntimeError("stall detection not running")
+        self.watchdog.stop()
+        self.artifacts['stalls.json'] = self.watchdog.report()
+        stalls = len(self.watchdog.stalls)
+        self.watchdog = None
+        logger.info(f"Event loop stall detection stopped ({stalls} stalls)")
+        return {'stalls': stalls, 'download': '/admin/stalls.json'}
+
+    def stop(self):
+        """关闭时停止仍在运行的分析"""
+        if self.cpu:
+            self.cpu.stop()
+            self.cpu = None
+        if self.watchdog:
+            self.watchdog.stop()
+            self.watchdog = None
+
+class AdminDownload:
+    """分析结果下载路由, 需要 Authorization: Bearer <令牌>"""
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def response(self, request_headers):
+        """生成 (status, headers, body)"""
+        scheme, _, token = request_headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not self.profiler.authorized(token):
+            return HTTPStatus.UNAUTHORIZED, [('Content-Type', 'text/plain'),
+                                             ('WWW-Authenticate', 'Bearer')], b'Unauthorized\n'
+        body = self.profiler.artifacts.get(self.name)
+        if body is None:
+            return HTTPStatus.NOT_FOUND, [('Content-Type', 'text/plain')], b'No profile recorded yet\n'
+        return HTTPStatus.OK, [
+            ('Content-Type', RuntimeProfiler.ARTIFACTS[self.name]),
+            ('Content-Disposition', f'attachment; filename="{self.name}"'),
+            ('Cache-Control', 'no-store'),
+        ], body
+
+class ProDJLinkWebSocketServer:
+    def __init__(self, websocket_port=8080, host='localhost', udp_host='0.0.0.0',
+                 debug_mode=True, analytics_interval=0.25, cache_max_age=0,
+                 relay_url=None, venue=None, relay_token=None, hub=False, shm_name=None,
+                 artnet_options=None, scheduler_options=None, api_port=None, trace_sample=0,
+                 workers=0, ingest_address=None, log_level=logging.INFO, snapshot_file=None,
+                 snapshot_interval=5.0, snapshot_ttl=30.0, admin_token=None):
+        self.PROLINK_HEADER = PROLINK_HEADER
+        
+        self.ports = {
+            50000: "ANNOUNCE",
+            50001: "BEAT", 
+            50002: "STATUS"
+        }
+        
+        self.websocket_port = websocket_port
+        self.host = host
+        self.udp_host = udp_host
+        self.cache_max_age = cache_max_age
+        self.http_routes = {}
+        self.connected_clients = {}  # websocket -> ClientSession
+        
+        self.devices = {}
+        self.current_status = {}
+        
+        self.sockets = []
+        self.running = False
+        self.loop = None
+        self.stop_future = None
+        self.on_ready = None  # 服务器就绪回调
+        
+        self.message_queue = asyncio.Queue()
+        
+        self.debug_mode = debug_mode
+        self.packet_count = {50000: 0, 50001: 0, 50002: 0}
+        
+        # 每个监听端口一个去重过滤器
+        self.packet_filters = {port: PacketDeduplicator() for port in self.ports}
+        
+        # 多场地汇聚: 边缘中继 / 中心hub
+        self.relay = EdgeRelay(relay_url, venue or socket.gethostname(), relay_token) if relay_url else None
+        self.hub = RelayHub(relay_token) if hub else None
+        
+        # 供本机其他进程读取的共享内存状态表
+        self.shm_name = shm_name
+        self.shared_table = None
+        
+        # 主控设备节拍时钟与Art-Net灯光输出
+        self.beat_clock = BeatClock()
+        self.artnet = ArtNetOutput(self.beat_clock, **artnet_options) if artnet_options else None
+        
+        # 节拍事件调度 (OSC)
+        self.scheduler = BeatScheduler(self.beat_clock, **scheduler_options) if scheduler_options else None
+        
+        # 状态快照 (序列化一次) 与HTTP/SSE状态接口
+        self.state_snapshot = StateSnapshot(self)
+        self.published_state = {}  # 状态键 -> 上次增加版本时的内容
+        self.state_api = StateAPIServer(self, host, api_port) if api_port else None
+        
+        # 热重启快照: 定期写盘, 启动时恢复
+        self.warm_snapshot = WarmSnapshot(snapshot_file, snapshot_interval, snapshot_ttl) if snapshot_file else None
+        
+        # 按需运行时分析, 仅在设置管理令牌时启用
+        self.profiler = RuntimeProfiler(admin_token) if admin_token else None
+        
+        # 抽样延迟追踪 (关闭时接收路径不受影响)
+        self.tracer = LatencyTracer(trace_sample) if trace_sample else None
+        
+        # 多进程前端: 采集进程 (workers>0) 或前端工作进程 (ingest_address)
+        self.workers = workers
+        self.ingest_address = ingest_address
+        self.log_level = log_level
+        self.publisher = None
+        self.worker_processes = []
+        
+        # 数据包分发表
+        self.packet_registry = PacketRegistry()
+        self.register_packet_kinds()
+        
+        # 节奏分析 (需要NumPy)
+        self.analytics = None
+        if analytics_interval and load_numpy() is not None:
+            self.analytics = TempoAnalytics(tick_interval=analytics_interval)
+        
+    def register_packet_kinds(self):
+        """注册已支持的数据包类型"""
+        registry = self.packet_registry
+        registry.register(50000, KIND_KEEPALIVE, self.decode_keepalive,
+                          KEEPALIVE_LENGTH, self.store_device)
+        registry.register(50002, KIND_CDJ_STATUS, self.decode_cdj_status,
+                          CDJ_STATUS_MIN_LENGTH, self.store_status)
+        registry.register(50002, KIND_MIXER_STATUS, self.decode_mixer_status,
+                          MIXER_STATUS_LENGTH, self.store_status)
+    
+    def store_device(self, message):
+        """保存设备信息"""
+        device = message['device']
+        self.devices[device['id']] = device
+    
+    def store_status(self, message):
+        """保存设备最新状态"""
+        status = message['status']
+        device_id = status['deviceId']
+        self.current_status[device_id] = status
+        self.beat_clock.update(status)
+        if self.analytics:
+            self.analytics.update(device_id, status)
+        if self.shared_table:
+            self.shared_table.write(status)
+    
+    def create_udp_socket(self, port):
+        """创建UDP套接字"""
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.tracer and SO_TIMESTAMPNS is not None:
+                try:
+                    sock.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                except OSError as e:
+                    logger.warning(f"Kernel receive timestamps unavailable on port {port}: {e}")
+            sock.bind((self.udp_host, port))
+            sock.settimeout(1.0)
+            self.sockets.append(sock)
+            logger.info(f"UDP socket bound to port {port}")
+            return sock
+        except Exception as e:
+            logger.error(f"Failed to create socket on port {port}: {e}")
+            return None
+    
+    def receive_traced(self, sock):
+        """接收一个数据包并取出内核接收时间戳 (纳秒, 不可用时为0)"""
+        data, ancdata, _, addr = sock.recvmsg(4096, socket.CMSG_SPACE(TIMESPEC.size))
+        kernel_ns = 0
+        for level, kind, payload in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_TIMESTAMPNS and len(payload) >= TIMESPEC.size:
+                seconds, nanoseconds = TIMESPEC.unpack_from(payload)
+                kernel_ns = seconds * 1000000000 + nanoseconds
+        return data, addr, kernel_ns
+    
+    def parse_announce_packet(self, data, addr):
+        """解析设备公告包"""
+        if len(data) < KEEPALIVE_LENGTH or data[:10] != self.PROLINK_HEADER:
+            return None
+        return self.decode_keepalive(data, addr)
+    
+    def parse_status_packet(self, data):
+        """解析状态包 - 包含节拍信息"""
+        if len(data) < CDJ_STATUS_MIN_LENGTH or data[:10] != self.PROLINK_HEADER:
+            return None
+        return self.decode_cdj_status(data, None)
+    
+    def decode_keepalive(self, data, addr):
+        """解码设备保活/公告包 (端口50000, 类型0x06), 调用前已校验包头和长度"""
+        try:
+            device_type = data[0x34]
+            type_name = DEVICE_TYPE_NAMES.get(device_type, f'Type{device_type}')
+            name = data[0x0C:0x20].split(b'\x00', 1)[0].decode('ascii', 'replace').strip()
+            return {
+                'type': 'device',
+                'device': {
+                    'ip': addr[0],
+                    'type': type_name,
+                    'id': data[0x24],
+                    'name': name or type_name
+                }
             }
             
-            # 设备ID - 尝试多个位置
-            device_id = 0
-            for offset in [33, 36]:
-                if len(data) > offset:
-                    temp_id = data[offset]
-                    if 0 < temp_id <= 6:
-                        device_id = temp_id
-                        status_info['status']['deviceId'] = device_id
-                        break
+        except Exception as e:
+            logger.error(f"Failed to parse ANNOUNCE packet: {e}")
+            return None
+    
+    def decode_mixer_status(self, data, addr):
+        """解码调音台状态包 (端口50002, 类型0x29), 调用前已校验包头和长度"""
+        try:
+            flags = data[0x27]
+            status = {
+                'deviceId': data[0x21],
+                'deviceType': 'Mixer',
+                'isMaster': bool(flags & 0x20),
+                'isSync': bool(flags & 0x10),
+            }
+            bpm_raw = struct.unpack_from('>H', data, 0x2E)[0]
+            if 0 < bpm_raw < 0xFFFF:
+                status['bpm'] = bpm_raw / 100.0
+            return {'type': 'status', 'status': status}
             
+        except Exception as e:
+            logger.error(f"Failed to parse mixer STATUS packet: {e}")
+            return None
+    
+    def decode_cdj_status(self, data, addr):
+        """解码CDJ状态包 (端口50002, 类型0x0A), 调用前已校验包头和长度"""
+        try:
+            status_info = {
+                'type': 'status',
+                'status': {
+                    'deviceId': data[0x21]
+                }
+            }
+            
+            # 以下偏移均小于最小包长, 由分发表保证, 无需逐项检查长度
             # 音轨ID
-            if len(data) >= 50:
-                track_id = struct.unpack('>I', data[46:50])[0]
-                status_info['status']['trackId'] = track_id
-                if track_id > 0:
-                    status_info['status']['track'] = {
-                        'id': track_id,
-                        'title': f'Track {track_id:08X}'
-                    }
+            track_id = struct.unpack_from('>I', data, 46)[0]
+            status_info['status']['trackId'] = track_id
+            if track_id > 0:
+                status_info['status']['track'] = {
+                    'id': track_id,
+                    'title': f'Track {track_id:08X}'
+                }
                 
             # 播放状态字节 (offset 123)
-            if len(data) > 123:
-                play_state = data[123]
-                status_info['status']['playState'] = self.decode_play_state(play_state)
-                status_info['status']['isPlaying'] = bool(play_state & 0x40)
-                status_info['status']['isMaster'] = bool(play_state & 0x20)
-                status_info['status']['isSync'] = bool(play_state & 0x10)
-                status_info['status']['isOnAir'] = bool(play_state & 0x08)
+            play_state = data[123]
+            status_info['status']['playState'] = self.decode_play_state(play_state)
+            status_info['status']['isPlaying'] = bool(play_state & 0x40)
+            status_info['status']['isMaster'] = bool(play_state & 0x20)
+            status_info['status']['isSync'] = bool(play_state & 0x10)
+            status_info['status']['isOnAir'] = bool(play_state & 0x08)
                 
             # BPM (offset 92-94)
-            if len(data) >= 94:
-                bpm_raw = struct.unpack('>H', data[92:94])[0]
-                if bpm_raw > 0:
-                    status_info['status']['bpm'] = bpm_raw / 100.0
+            bpm_raw = struct.unpack_from('>H', data, 92)[0]
+            if bpm_raw > 0:
+                status_info['status']['bpm'] = bpm_raw / 100.0
                     
             # Pitch (offset 132-136)
-            if len(data) >= 136:
-                pitch_raw = struct.unpack('>i', data[132:136])[0]
-                status_info['status']['pitch'] = pitch_raw / 1048576.0 * 100
+            pitch_raw = struct.unpack_from('>i', data, 132)[0]
+            status_info['status']['pitch'] = pitch_raw / 1048576.0 * 100
                 
             # Beat计数器 (offset 88-92) - 用于计算beatInMeasure
-            if len(data) >= 92:
-                beat_count = struct.unpack('>I', data[88:92])[0]
-                # 计算小节内的节拍位置 (1-4)
-                beat_in_measure = (beat_count % 4) + 1 if beat_count > 0 else 0
-                status_info['status']['beatInMeasure'] = beat_in_measure
-                status_info['status']['beat'] = beat_count
-                
-                if self.debug_mode and beat_in_measure > 0:
-                    print(f"  Beat: count={beat_count}, position={beat_in_measure}/4")
+            beat_count = struct.unpack_from('>I', data, 88)[0]
+            # 计算小节内的节拍位置 (1-4)
+            beat_in_measure = (beat_count % 4) + 1 if beat_count > 0 else 0
+            status_info['status']['beatInMeasure'] = beat_in_measure
+            status_info['status']['beat'] = beat_count
+            
+            if self.debug_mode and beat_in_measure > 0:
+                print(f"  Beat: count={beat_count}, position={beat_in_measure}/4")
                 
             # 播放位置 (offset 164-168)
-            if len(data) >= 168:
-                position_ms = struct.unpack('>I', data[164:168])[0]
-                if position_ms > 0:
-                    minutes = position_ms // 60000
-                    seconds = (position_ms % 60000) / 1000
-                    status_info['status']['time'] = f"{minutes:02.0f}:{seconds:05.2f}"
+            position_ms = struct.unpack_from('>I', data, 164)[0]
+            if position_ms > 0:
+                minutes = position_ms // 60000
+                seconds = (position_ms % 60000) / 1000
+                status_info['status']['time'] = f"{minutes:02.0f}:{seconds:05.2f}"
                     
             return status_info
             
         except Exception as e:
-            logger.error(f"Failed to parse STATUS packet: {e}")
+            logger.error(f"Failed to parse CDJ STATUS packet: {e}")
             return None
     
     def decode_play_state(self, state_byte):
@@ -812,7 +3578,8 @@ class ProDJLinkWebSocketServer:
         """打印原始数据用于调试"""
         if not self.debug_mode:
             return
-            
+        
+        from datetime import datetime
         timestamp = datetime.now().strftime("%H:%M:%S.%f")[:-3]
         self.packet_count[port] += 1
         
@@ -843,32 +3610,35 @@ class ProDJLinkWebSocketServer:
             return
             
         port_name = self.ports[port]
+        packet_filter = self.packet_filters[port]
+        dispatch = self.packet_registry.dispatch
+        tracer = self.tracer
+        traced = tracer is not None and hasattr(sock, 'recvmsg')
         logger.info(f"Started listening on UDP port {port} ({port_name})")
         
         while self.running:
             try:
-                data, addr = sock.recvfrom(4096)
+                if traced:
+                    data, addr, kernel_ns = self.receive_traced(sock)
+                    recv_ns = time.time_ns()
+                else:
+                    data, addr = sock.recvfrom(4096)
+                
+                # 丢弃重复和过期的乱序包
+                if not packet_filter.accept(port, data, addr):
+                    continue
                 
                 # 调试模式：打印原始数据
                 if self.debug_mode:
                     self.print_raw_data(port, data, addr)
                 
-                # 解析数据包
-                message = None
-                if port == 50000:  # ANNOUNCE
-                    message = self.parse_announce_packet(data, addr)
-                    if message:
-                        device_id = message['device']['id']
-                        self.devices[device_id] = message['device']
-                        
-                elif port == 50002:  # STATUS (包含节拍信息)
-                    message = self.parse_status_packet(data)
-                    if message and 'deviceId' in message['status']:
-                        device_id = message['status']['deviceId']
-                        self.current_status[device_id] = message['status']
+                # 查表分发到对应的解码器
+                message = dispatch(port, data, addr)
                 
                 # 将消息放入队列
                 if message:
+                    if traced:
+                        tracer.maybe_trace(message, kernel_ns, recv_ns)
                     asyncio.run_coroutine_threadsafe(
                         self.message_queue.put(message),
                         self.loop
@@ -882,61 +3652,266 @@ class ProDJLinkWebSocketServer:
                 break
                 
         sock.close()
-        logger.info(f"Stopped listening on UDP port {port}")
+        stats = packet_filter.stats
+        logger.info(f"Stopped listening on UDP port {port} "
+                    f"(received {stats['received']}, duplicates {stats['duplicates']}, "
+                    f"stale {stats['stale']} dropped before parsing)")
+    
+    def filter_stats(self):
+        """汇总所有端口的去重统计"""
+        totals = {'received': 0, 'passed': 0, 'duplicates': 0, 'stale': 0}
+        for packet_filter in self.packet_filters.values():
+            for name, value in packet_filter.stats.items():
+                totals[name] += value
+        totals['saved'] = totals['duplicates'] + totals['stale']
+        return totals
+    
+    def ingest_stats(self):
+        """去重、分发与中继的累计计数, 供 /metrics/ingest 使用"""
+        stats = {
+            'filter': self.filter_stats(),
+            'filterByPort': {port: dict(packet_filter.stats) for port, packet_filter in self.packet_filters.items()},
+            'registry': dict(self.packet_registry.stats),
+        }
+        if self.relay:
+            stats['relay'] = dict(self.relay.stats, connected=self.relay.connected, version=self.relay.version)
+        return stats
+    
+    def build_http_routes(self):
+        """预压缩界面页面并建立HTTP路由表"""
+        # 页面URL不带版本指纹, 默认no-cache, 服务器升级后浏览器立即拿到新页面
+        page = PrecompressedAsset(HTML_CONTENT, max_age=self.cache_max_age)
+        self.http_routes['/'] = page
+        self.http_routes['/index.html'] = page
+        self.http_routes['/state'] = self.state_snapshot
+        self.http_routes['/metrics/ingest'] = JSONEndpoint(self.ingest_stats)
+        if self.tracer:
+            self.http_routes['/metrics/latency'] = JSONEndpoint(self.tracer.summary)
+        if self.profiler:
+            for name in RuntimeProfiler.ARTIFACTS:
+                self.http_routes[f'/admin/{name}'] = AdminDownload(self.profiler, name)
+    
+    async def process_request(self, path, request_headers):
+        """在WebSocket握手前处理普通HTTP请求"""
+        if request_headers.get('Upgrade', '').lower() == 'websocket':
+            return None
+        
+        route = self.http_routes.get(path.split('?', 1)[0])
+        if route is None:
+            return HTTPStatus.NOT_FOUND, [('Content-Type', 'text/plain')], b'Not Found\n'
+        return route.response(request_headers)
     
     async def websocket_handler(self, websocket, path):
         """处理WebSocket连接"""
-        self.connected_clients.add(websocket)
+        if self.hub and path.split('?', 1)[0] == '/relay':
+            try:
+                await self.hub.handle(websocket, self)
+            except (websockets.exceptions.ConnectionClosed, ValueError, KeyError, zlib.error) as e:
+                logger.warning(f"Relay connection error: {e}")
+            return
+        
+        session = ClientSession(websocket, tracer=self.tracer)
+        self.connected_clients[websocket] = session
         client_addr = websocket.remote_address
         logger.info(f"WebSocket client connected: {client_addr}")
         
         try:
-            # 发送当前设备列表
-            for device in self.devices.values():
-                await websocket.send(json.dumps({
-                    'type': 'device',
-                    'device': device
-                }))
+            # 发送当前设备列表与当前状态
+            for device in list(self.devices.values()):
+                message = {'type': 'device', 'device': device}
+                session.offer(message, json.dumps(message))
+            for status in list(self.current_status.values()):
+                message = {'type': 'status', 'status': status}
+                session.offer(message, json.dumps(message))
+            session.start()
                 
-            # 发送当前状态
-            for status in self.current_status.values():
-                await websocket.send(json.dumps({
-                    'type': 'status',
-                    'status': status
-                }))
-                
-            # 保持连接
-            await websocket.wait_closed()
+            # 处理客户端消息直到连接关闭
+            async for raw in websocket:
+                reply = await self.handle_client_message(session, raw)
+                if reply is not None:
+                    await websocket.send(json.dumps(reply))
             
         except websockets.exceptions.ConnectionClosed:
             pass
         finally:
-            self.connected_clients.remove(websocket)
+            session.stop()
+            self.connected_clients.pop(websocket, None)
             logger.info(f"WebSocket client disconnected: {client_addr}")
     
+    async def handle_client_message(self, session, raw):
+        """处理客户端发来的消息, 需要回复时返回回复内容"""
+        try:
+            message = json.loads(raw)
+        except (TypeError, ValueError):
+            return None
+        if not isinstance(message, dict):
+            return None
+        message_type = message.get('type')
+        if message_type == 'echo' and self.tracer:
+            trace_id = message.get('trace')
+            # 追踪ID只能是整数, 其他类型 (列表/对象) 不能作为字典键, 直接忽略
+            if type(trace_id) is int:
+                self.tracer.echoed(trace_id, session.rtt)
+        elif message_type == 'admin' and self.profiler:
+            return await self.handle_admin_command(session, message)
+        return None
+    
+    async def handle_admin_command(self, session, message):
+        """执行管理命令 (分析器开关与结果导出)"""
+        command = message.get('command')
+        if not self.profiler.authorized(message.get('token')):
+            logger.warning(f"Rejected admin command '{command}' from {session.websocket.remote_address}")
+            return {'type': 'admin', 'command': command, 'ok': False, 'error': 'unauthorized'}
+        options = message.get('options')
+        result = await self.profiler.execute(command, options if isinstance(options, dict) else {})
+        return {'type': 'admin', 'command': command, **result}
+    
     async def broadcast_messages(self):
         """广播消息到所有WebSocket客户端"""
         while self.running:
             try:
                 message = await asyncio.wait_for(self.message_queue.get(), timeout=1.0)
                 
-                if self.connected_clients:
-                    message_json = json.dumps(message)
-                    disconnected = set()
-                    
-                    for client in self.connected_clients:
-                        try:
-                            await client.send(message_json)
-                        except websockets.exceptions.ConnectionClosed:
-                            disconnected.add(client)
-                            
-                    self.connected_clients -= disconnected
+                trace = self.tracer.dequeued(message) if self.tracer else None
+                if self.relay:
+                    self.relay.record(message)
+                self.track_state_change(message)
+                
+                # 每条消息只序列化一次, WebSocket、SSE与前端工作进程共享
+                if (not self.connected_clients
+                        and not (self.state_api and self.state_api.subscribers)
+                        and not (self.publisher and self.publisher.links)):
+                    continue
+                self.fan_out(message, json.dumps(message), trace)
                     
             except asyncio.TimeoutError:
                 continue
             except Exception as e:
                 logger.error(f"Broadcast message error: {e}")
     
+    def track_state_change(self, message):
+        """状态内容确实变化时才增加快照版本 (CDJ暂停时仍持续发送相同的状态)"""
+        key = state_key(message)
+        if key is not None:
+            entry = message[key[0]]
+            if self.published_state.get(key) != entry:
+                self.published_state[key] = dict(entry)
+                self.state_snapshot.touch()
+        elif message.get('type') == 'remove':
+            device_key = table_key(message['device'], message['device']['id'])
+            self.published_state.pop(('device', device_key), None)
+            self.published_state.pop(('status', device_key), None)
+            self.state_snapshot.touch()
+    
+    def fan_out(self, message, message_json, trace=None):
+        """把已编码的消息分发给本进程的所有订阅者"""
+        if self.publisher:
+            self.publisher.publish(message_json)
+        if self.state_api and self.state_api.subscribers:
+            self.state_api.publish(message, message_json)
+        
+        # 交给每个客户端的会话, 由其按自身速率发送
+        for session in list(self.connected_clients.values()):
+            session.offer(message, message_json, trace)
+    
+    async def consume_ingest_feed(self):
+        """前端工作进程: 接收采集进程发布的更新并分发给本进程的客户端"""
+        while self.running:
+            try:
+                reader, writer = await asyncio.open_connection(*self.ingest_address)
+            except OSError as e:
+                logger.warning(f"Cannot reach ingest process at {self.ingest_address}: {e}")
+                await asyncio.sleep(1.0)
+                continue
+            
+            try:
+                while True:
+                    length = FEED_FRAME.unpack(await reader.readexactly(FEED_FRAME.size))[0]
+                    message_json = (await reader.readexactly(length)).decode('utf-8')
+                    message = json.loads(message_json)
+                    key = state_key(message)
+                    if key is not None:
+                        table = self.devices if key[0] == 'device' else self.current_status
+                        table[key[1]] = message[key[0]]
+                    elif message.get('type') == 'remove':
+                        device_key = table_key(message['device'], message['device']['id'])
+                        self.devices.pop(device_key, None)
+                        self.current_status.pop(device_key, None)
+                    self.track_state_change(message)
+                    self.fan_out(message, message_json)
+            except (asyncio.IncompleteReadError, ConnectionError) as e:
+                if self.running:
+                    logger.warning(f"Ingest feed lost: {e}")
+            finally:
+                writer.close()
+            if self.running:
+                await asyncio.sleep(1.0)
+    
+    def spawn_frontend_worker(self, index):
+        """启动一个前端工作进程"""
+        import multiprocessing
+        context = multiprocessing.get_context('spawn')
+        options = {
+            'port': self.websocket_port,
+            'host': self.host,
+            'cache_max_age': self.cache_max_age,
+            'ingest_address': (self.publisher.host, self.publisher.port),
+            'log_level': self.log_level,
+        }
+        process = context.Process(target=run_frontend_worker, args=(options,),
+                                  name=f'frontend-{index}', daemon=True)
+        process.start()
+        return process
+    
+    def start_frontend_workers(self):
+        """启动前端工作进程, 各自以SO_REUSEPORT共享对外端口"""
+        self.worker_processes = [self.spawn_frontend_worker(index) for index in range(self.workers)]
+    
+    async def supervise_frontend_workers(self):
+        """重启意外退出的前端工作进程"""
+        while self.running:
+            await asyncio.sleep(2.0)
+            for index, process in enumerate(self.worker_processes):
+                if not process.is_alive() and self.running:
+                    logger.warning(f"Frontend worker {process.name} exited ({process.exitcode}), restarting")
+                    self.worker_processes[index] = self.spawn_frontend_worker(index)
+    
+    def stop_frontend_workers(self):
+        """结束所有前端工作进程"""
+        for process in self.worker_processes:
+            process.terminate()
+        for process in self.worker_processes:
+            process.join(5)
+        self.worker_processes = []
+    
+    async def snapshot_loop(self):
+        """定期写入热重启快照"""
+        while self.running:
+            await asyncio.sleep(self.warm_snapshot.interval)
+            try:
+                await self.warm_snapshot.checkpoint(self)
+            except OSError as e:
+                logger.error(f"Snapshot write error: {e}")
+    
+    async def expire_restored(self):
+        """等待实时数据确认恢复的条目, 期满后删除未确认的设备"""
+        await asyncio.sleep(self.warm_snapshot.provisional_ttl)
+        for message in self.warm_snapshot.expire(self):
+            await self.message_queue.put(message)
+    
+    async def analytics_loop(self):
+        """按固定节拍计算节奏分析并发布"""
+        interval = self.analytics.tick_interval
+        next_tick = self.loop.time()
+        while self.running:
+            next_tick += interval
+            await asyncio.sleep(max(0.0, next_tick - self.loop.time()))
+            try:
+                for message in self.analytics.tick():
+                    await self.message_queue.put(message)
+            except Exception as e:
+                logger.error(f"Tempo analytics error: {e}")
+    
     async def start_websocket_server(self):
         """启动WebSocket服务器"""
         logger.info(f"Starting WebSocket server on port: {self.websocket_port}")
@@ -944,23 +3919,96 @@ class ProDJLinkWebSocketServer:
         self.loop = asyncio.get_event_loop()
         
         self.running = True
-        for port in [50000, 50002]:  # 只监听ANNOUNCE和STATUS
-            thread = threading.Thread(target=self.listen_udp_port, args=(port,))
-            thread.daemon = True
-            thread.start()
+        restored = 0
+        if self.ingest_address is None:
+            if self.warm_snapshot:
+                restored = self.warm_snapshot.restore(self)
+            
+            if self.shm_name and not self.shared_table:
+                self.shared_table = SharedStatusTable(self.shm_name)
+                logger.info(f"Publishing latest status to shared memory '{self.shm_name}'")
+            
+            for port in [50000, 50002]:  # 只监听ANNOUNCE和STATUS
+                thread = threading.Thread(target=self.listen_udp_port, args=(port,), name=f'udp-{port}')
+                thread.daemon = True
+                thread.start()
+        
+        if self.state_api:
+            await self.state_api.start()
+        if self.artnet:
+            self.artnet.start()
+        if self.scheduler:
+            self.scheduler.start()
+        
+        tasks = [asyncio.create_task(self.broadcast_messages())]
+        if self.analytics:
+            tasks.append(asyncio.create_task(self.analytics_loop()))
+        if self.relay:
+            tasks.append(asyncio.create_task(self.relay.run(self)))
+        if self.ingest_address:
+            tasks.append(asyncio.create_task(self.consume_ingest_feed()))
+        if self.warm_snapshot:
+            tasks.append(asyncio.create_task(self.snapshot_loop()))
+            if restored:
+                tasks.append(asyncio.create_task(self.expire_restored()))
         
-        broadcast_task = asyncio.create_task(self.broadcast_messages())
+        self.stop_future = self.loop.create_future()
+        self.build_http_routes()
         
-        async with websockets.serve(self.websocket_handler, 'localhost', self.websocket_port):
-            logger.info(f"WebSocket server running: ws://localhost:{self.websocket_port}")
+        async with contextlib.AsyncExitStack() as stack:
+            if self.workers:
+                # 采集进程: 客户端由前端工作进程服务
+                self.publisher = IngestPublisher(self)
+                await self.publisher.start()
+                stack.push_async_callback(self.publisher.close)
+                stack.callback(self.stop_frontend_workers)
+                self.start_frontend_workers()
+                await self.publisher.wait_for_links(self.workers, timeout=60)
+                tasks.append(asyncio.create_task(self.supervise_frontend_workers()))
+                logger.info(f"Ingest process feeding {self.workers} frontend workers on port {self.websocket_port}")
+            else:
+                await stack.enter_async_context(websockets.serve(
+                    self.websocket_handler, self.host, self.websocket_port,
+                    process_request=self.process_request,
+                    reuse_port=self.ingest_address is not None))
+                logger.info(f"WebSocket server running: ws://{self.host}:{self.websocket_port}")
+                logger.info(f"Web interface available: http://{self.host}:{self.websocket_port}/")
+            if self.on_ready:
+                self.on_ready(self)
             
             try:
-                await asyncio.Future()
+                await self.stop_future
             except KeyboardInterrupt:
                 logger.info("Received stop signal")
             finally:
                 self.running = False
-                broadcast_task.cancel()
+                for task in tasks:
+                    task.cancel()
+                if self.state_api:
+                    await self.state_api.close()
+                if self.artnet:
+                    self.artnet.stop()
+                    logger.info(f"Art-Net jitter: {self.artnet.jitter_report()}")
+                if self.scheduler:
+                    self.scheduler.stop()
+                    logger.info(f"Beat scheduler timing: {self.scheduler.report()}")
+                if self.tracer:
+                    logger.info(f"Latency summary (ms): {self.tracer.summary()}")
+                if self.profiler:
+                    self.profiler.stop()
+                if self.warm_snapshot:
+                    try:
+                        await self.warm_snapshot.checkpoint(self)
+                    except OSError as e:
+                        logger.error(f"Snapshot write error: {e}")
+    
+    def stop(self):
+        """从任意线程请求停止服务器"""
+        def _stop():
+            if self.stop_future and not self.stop_future.done():
+                self.stop_future.set_result(None)
+        if self.loop:
+            self.loop.call_soon_threadsafe(_stop)
     
     def run(self):
         """运行服务器"""
@@ -977,16 +4025,151 @@ class ProDJLinkWebSocketServer:
                     sock.close()
                 except:
                     pass
+            if self.shared_table:
+                self.shared_table.close()
+                self.shared_table = None
 
-def create_html_file():
-    """创建HTML文件并返回路径"""
-    html_file = tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8')
-    html_file.write(HTML_CONTENT)
-    html_file.close()
-    return html_file.name
+def _median_subprocess_time(code, runs):
+    """在新解释器中运行代码多次, 返回其打印耗时的中位数 (秒)"""
+    import statistics
+    import subprocess
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=module_dir)
+        samples.append(float(output))
+    return statistics.median(samples)
 
-def main():
-    """主函数"""
+def benchmark_startup(runs=10, websocket_port=0):
+    """导入耗时与启动耗时基准测试"""
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    timer = "import time; t = time.perf_counter(); {imports}; print(time.perf_counter() - t)"
+
+    lazy = _median_subprocess_time(timer.format(imports=f"import {module}"), runs)
+    # 旧版本在导入时即加载这些模块
+    eager = _median_subprocess_time(timer.format(
+        imports=f"import webbrowser, tempfile, datetime, logging; logging.basicConfig(); "
+                f"import {module}; {module}.load_numpy()"), runs)
+
+    print(f"[BENCH] import (lazy):          {lazy * 1000:8.2f} ms")
+    print(f"[BENCH] import (eager imports): {eager * 1000:8.2f} ms")
+    print(f"[BENCH] import gain:            {(eager - lazy) * 1000:8.2f} ms")
+
+    # 启动耗时: 构造服务器到WebSocket端口可接受连接
+    samples = []
+    for _ in range(runs):
+        ready = threading.Event()
+        started = time.perf_counter()
+        server = ProDJLinkWebSocketServer(websocket_port=websocket_port, debug_mode=False,
+                                          analytics_interval=0)
+        server.on_ready = lambda _server: ready.set()
+        thread = threading.Thread(target=server.run, daemon=True)
+        thread.start()
+        if not ready.wait(10):
+            print("[BENCH] server did not become ready")
+            return 1
+        samples.append(time.perf_counter() - started)
+        server.stop()
+        thread.join(5)
+
+    samples.sort()
+    print(f"[BENCH] startup to ready (median of {runs}): {samples[len(samples) // 2] * 1000:8.2f} ms")
+    print("[BENCH] old startup added a fixed 1000 ms sleep before serving")
+    return 0
+
+def osc_target(value):
+    """解析 HOST:PORT 形式的OSC目标 (省略主机时为127.0.0.1)"""
+    import argparse
+    host, sep, port = value.rpartition(':')
+    try:
+        port = int(port)
+    except ValueError:
+        port = None
+    if not sep or port is None or not 0 < port < 65536:
+        raise argparse.ArgumentTypeError(f"expected HOST:PORT, got '{value}'")
+    return host or '127.0.0.1', port
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    import argparse
+    parser = argparse.ArgumentParser(description="ProDJLink Web Monitor")
+    parser.add_argument('--port', type=int, default=8080, help="WebSocket port (default: 8080)")
+    parser.add_argument('--host', default='localhost',
+                        help="WebSocket bind address (default: localhost, use 0.0.0.0 for all interfaces)")
+    parser.add_argument('--udp-host', default='0.0.0.0', help="UDP bind address (default: 0.0.0.0)")
+    parser.add_argument('--headless', action='store_true',
+                        help="no banner and no browser; suitable for supervisors")
+    parser.add_argument('--debug', dest='debug', action='store_true', default=None,
+                        help="print decoded packets (default: on unless --headless)")
+    parser.add_argument('--no-debug', dest='debug', action='store_false')
+    parser.add_argument('--analytics-interval', type=float, default=0.25,
+                        help="tempo analytics tick in seconds, 0 to disable (default: 0.25)")
+    parser.add_argument('--cache-max-age', type=int, default=0,
+                        help="Cache-Control max-age for the web interface in seconds; the default 0 sends "
+                             "no-cache so browsers revalidate (304) and pick up a new page after upgrades")
+    parser.add_argument('--relay-to', metavar='URL',
+                        help="edge relay mode: forward state changes to a hub, e.g. ws://hub:8080/relay")
+    parser.add_argument('--venue', help="venue name reported by the edge relay (default: hostname)")
+    parser.add_argument('--hub', action='store_true', help="accept edge relays on the /relay path")
+    parser.add_argument('--relay-token', help="shared secret between edge relays and the hub")
+    parser.add_argument('--shm-name', help="publish latest per-device status to this shared memory segment")
+    parser.add_argument('--artnet', metavar='TARGET',
+                        help="drive Art-Net DMX output to this address (e.g. 2.255.255.255)")
+    parser.add_argument('--artnet-port', type=int, default=ARTNET_PORT)
+    parser.add_argument('--artnet-universe', type=int, default=0, help="first Art-Net universe (default: 0)")
+    parser.add_argument('--artnet-fixtures', type=int, default=8, help="number of fixtures (default: 8)")
+    parser.add_argument('--artnet-channels', type=int, default=1, help="DMX channels per fixture (default: 1)")
+    parser.add_argument('--artnet-fps', type=float, default=40.0, help="DMX frame rate (default: 40)")
+    parser.add_argument('--artnet-effect', choices=ArtNetOutput.EFFECTS, default='pulse')
+    parser.add_argument('--osc-target', metavar='HOST:PORT', type=osc_target, action='append', default=[],
+                        help="send scheduled beat/bar OSC events here (repeatable)")
+    parser.add_argument('--osc-clock', action='store_true', help="also send 24-PPQN /clock ticks")
+    parser.add_argument('--output-latency-ms', type=float, default=0.0,
+                        help="send events this much earlier to compensate output latency")
+    parser.add_argument('--api-port', type=int,
+                        help="serve the read-only /state API and /events SSE stream on this port")
+    parser.add_argument('--trace-sample', type=int, default=0, metavar='N',
+                        help="trace latency of every Nth decoded packet, 0 to disable; "
+                             "summary at /metrics/latency")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="serve clients from N frontend processes sharing the port (Linux), "
+                             "fed by this ingest process")
+    parser.add_argument('--snapshot-file', metavar='PATH',
+                        help="checkpoint devices and statuses here and restore them on startup")
+    parser.add_argument('--snapshot-interval', type=float, default=5.0,
+                        help="seconds between snapshot checkpoints (default: 5)")
+    parser.add_argument('--snapshot-ttl', type=float, default=30.0,
+                        help="drop restored devices not confirmed by live packets within this many seconds "
+                             "(default: 30)")
+    parser.add_argument('--admin-token',
+                        help="enable admin commands over the WebSocket (CPU/allocation profiling, "
+                             "event loop stall detection) and /admin downloads with this token")
+    parser.add_argument('--log-level', default='INFO', help="logging level (default: INFO)")
+    parser.add_argument('--benchmark-startup', action='store_true',
+                        help="measure import and startup time, then exit")
+    parser.add_argument('--benchmark-shm', action='store_true',
+                        help="measure shared memory read throughput, then exit")
+    parser.add_argument('--benchmark-scheduler', action='store_true',
+                        help="measure beat scheduler jitter and drift against a simulated deck, then exit")
+    parser.add_argument('--benchmark-fanout', action='store_true',
+                        help="measure fan-out throughput with 1, 2 and 4 frontend workers, then exit")
+    args = parser.parse_args(argv)
+    if args.workers and args.hub:
+        parser.error("--hub cannot be combined with --workers")
+    if args.workers and not hasattr(socket, 'SO_REUSEPORT'):
+        parser.error("--workers requires SO_REUSEPORT support")
+    if args.workers and args.trace_sample:
+        # 客户端会话和 /metrics/latency 都在前端工作进程中, 采集进程无法完成追踪
+        parser.error("--trace-sample cannot be combined with --workers")
+    if args.workers and args.admin_token:
+        # 管理命令会落到前端工作进程, 而要分析的UDP监听与事件循环在采集进程中
+        parser.error("--admin-token cannot be combined with --workers")
+    if args.debug is None:
+        args.debug = not args.headless
+    return args
+
+def print_banner():
+    """打印启动信息"""
     print("=" * 60)
     print("[DJ] ProDJLink Web Monitor - Fixed Version")
     print("=" * 60)
@@ -995,51 +4178,105 @@ def main():
     print("[DEBUG] Beat information from STATUS packets (port 50002)")
     print("=" * 60)
     print()
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    log_level = getattr(logging, args.log_level.upper(), logging.INFO)
+    configure_console(log_level)
     
-    # 检查依赖
-    try:
-        import websockets
-    except ImportError:
+    # 检查依赖 (不在运行时安装任何包)
+    if websockets is None:
         print("[ERROR] websockets library not found")
-        print("[INFO] Installing websockets...")
-        import subprocess
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "websockets"])
-        print("[OK] websockets installed")
-        import websockets
+        print("[INFO] Install it with: pip install websockets")
+        return 1
     
-    # 创建HTML文件
-    print("[CREATE] Creating HTML interface...")
-    html_path = create_html_file()
-    print(f"[OK] HTML file created: {html_path}")
+    if args.benchmark_startup:
+        return benchmark_startup()
+    if args.benchmark_shm:
+        return benchmark_shared_memory()
+    if args.benchmark_scheduler:
+        return benchmark_scheduler(clock_ticks=True)
+    if args.benchmark_fanout:
+        return benchmark_fanout()
     
-    # 打开浏览器
-    print("[BROWSER] Opening web interface...")
-    time.sleep(1)
-    webbrowser.open(f"file:///{html_path}")
+    browser_host = 'localhost' if args.host in ('', '0.0.0.0', '::') else args.host
+    ui_url = f"http://{browser_host}:{args.port}/"
     
-    print()
-    print("[START] Starting WebSocket server...")
-    print("[INFO] Listening on:")
-    print("  - WebSocket: ws://localhost:8080")
-    print("  - UDP: 50000 (ANNOUNCE)")
-    print("  - UDP: 50002 (STATUS with beat info)")
-    print()
-    print("[READY] Monitor is running!")
-    print("[INFO] Beat indicators will show 1-4 position in measure")
-    print()
-    print("Press Ctrl+C to stop...")
-    print()
+    if not args.headless:
+        print_banner()
+        
+        print("[START] Starting WebSocket server...")
+        print("[INFO] Listening on:")
+        print(f"  - Web UI: http://{args.host}:{args.port}/")
+        print(f"  - WebSocket: ws://{args.host}:{args.port}")
+        print("  - UDP: 50000 (ANNOUNCE)")
+        print("  - UDP: 50002 (STATUS with beat info)")
+        print()
+        print("[READY] Monitor is running!")
+        print("[INFO] Beat indicators will show 1-4 position in measure")
+        print()
+        print("Press Ctrl+C to stop...")
+        print()
     
-    server = ProDJLinkWebSocketServer()
+    artnet_options = None
+    if args.artnet:
+        artnet_options = {
+            'target': args.artnet,
+            'port': args.artnet_port,
+            'universe': args.artnet_universe,
+            'fixtures': args.artnet_fixtures,
+            'channels_per_fixture': args.artnet_channels,
+            'fps': args.artnet_fps,
+            'effect': args.artnet_effect,
+        }
+    
+    scheduler_options = None
+    if args.osc_target:
+        scheduler_options = {
+            'targets': args.osc_target,
+            'clock_ticks': args.osc_clock,
+            'output_latency': args.output_latency_ms / 1000.0,
+        }
+    
+    server = ProDJLinkWebSocketServer(
+        websocket_port=args.port,
+        host=args.host,
+        udp_host=args.udp_host,
+        debug_mode=args.debug,
+        analytics_interval=args.analytics_interval,
+        cache_max_age=args.cache_max_age,
+        relay_url=args.relay_to,
+        venue=args.venue,
+        relay_token=args.relay_token,
+        hub=args.hub,
+        shm_name=args.shm_name,
+        artnet_options=artnet_options,
+        scheduler_options=scheduler_options,
+        api_port=args.api_port,
+        trace_sample=args.trace_sample,
+        workers=args.workers,
+        log_level=log_level,
+        snapshot_file=args.snapshot_file,
+        snapshot_interval=args.snapshot_interval,
+        snapshot_ttl=args.snapshot_ttl,
+        admin_token=args.admin_token,
+    )
+    
+    if not args.headless:
+        # 服务器就绪后再打开浏览器
+        def open_browser(_server):
+            import webbrowser
+            print("[BROWSER] Opening web interface...")
+            webbrowser.open(ui_url)
+        server.on_ready = open_browser
     
     try:
         server.run()
     finally:
-        try:
-            os.unlink(html_path)
-        except:
-            pass
-        print("[STOP] Monitor stopped")
+        if not args.headless:
+            print("[STOP] Monitor stopped")
+    return 0
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())